@@ -1,10 +1,15 @@
 import os
 import json
+import time
 import hashlib
+import threading
 import httpx
 import numpy as np
+from collections import OrderedDict
+import psycopg
 import streamlit as st
-from sqlalchemy import create_engine, text
+from pgvector.psycopg import register_vector
+from sqlalchemy import create_engine, event, text
 import google.generativeai as genai
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
@@ -23,13 +28,36 @@ genai.configure(api_key=GOOGLE_API_KEY)
 # ── Database ──────────────────────────────────────────────────────────────────
 DB_URL = os.environ.get("DB_URL", "")
 engine = create_engine(
-    DB_URL.replace("postgresql://", "postgresql+psycopg2://"),
+    DB_URL.replace("postgresql://", "postgresql+psycopg://"),
     future=True
 )
 
+@event.listens_for(engine, "connect")
+def register_vector_types(dbapi_conn, _):
+    try:
+        register_vector(dbapi_conn)
+    except psycopg.ProgrammingError:
+        pass
+
+def to_vector(embedding):
+    return np.asarray(embedding, dtype=np.float32)
+
+def has_column(conn, table, column):
+    # ALTER TABLE ... ADD COLUMN IF NOT EXISTS still takes an ACCESS EXCLUSIVE lock, so the
+    # migrations below only run when the column is really missing
+    return conn.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column;
+    """), {"table": table, "column": column}).first() is not None
+
+@st.cache_resource
 def init_db():
+    # once per process: Streamlit reruns the script on every interaction
     with engine.connect() as conn:
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
+        conn.commit()
+    engine.dispose()
+    with engine.connect() as conn:
         conn.execute(text("""
             CREATE TABLE IF NOT EXISTS drug_labels (
                 id SERIAL PRIMARY KEY,
@@ -56,6 +84,32 @@ def init_db():
                 UNIQUE(label_id, section, chunk_index)
             );
         """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS label_chunks_unembedded
+            ON label_chunks (label_id, id) WHERE embedding IS NULL;
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS query_rewrites (
+                question TEXT NOT NULL,
+                model TEXT NOT NULL,
+                rewritten TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                last_used_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (question, model)
+            );
+        """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS query_rewrites_last_used ON query_rewrites (last_used_at);
+        """))
+        if not has_column(conn, "label_chunks", "content_tsv"):
+            conn.execute(text("""
+                ALTER TABLE label_chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector
+                GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+            """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS label_chunks_content_tsv_gin
+            ON label_chunks USING gin (content_tsv);
+        """))
         conn.commit()
 
 def save_label(drug_query, brand_name, generic_name, manufacturer, effective_time, sections, raw_result):
@@ -92,17 +146,16 @@ def save_chunks(label_id, chunks):
         conn.commit()
 
 def save_embedding(chunk_id, embedding):
-    emb_str = "[" + ",".join([str(float(x)) for x in embedding]) + "]"
     with engine.connect() as conn:
         conn.execute(text("UPDATE label_chunks SET embedding = :emb WHERE id = :id;"),
-                     {"emb": emb_str, "id": chunk_id})
+                     {"emb": to_vector(embedding), "id": chunk_id})
         conn.commit()
 
-def get_chunks_without_embeddings():
+def get_chunks_without_embeddings(label_id):
     with engine.connect() as conn:
         rows = conn.execute(text(
-            "SELECT id, content FROM label_chunks WHERE embedding IS NULL ORDER BY id;"
-        )).mappings().all()
+            "SELECT id, content FROM label_chunks WHERE label_id = :label_id AND embedding IS NULL ORDER BY id;"
+        ), {"label_id": label_id}).mappings().all()
     return [dict(r) for r in rows]
 
 def get_recent_labels(limit=10):
@@ -147,10 +200,12 @@ def get_query_embedding(text_content):
     return result["embedding"]
 
 # ── LLM ───────────────────────────────────────────────────────────────────────
+LLM_MODEL = os.environ.get("LLM_MODEL", "gemini-2.0-flash")
+
 @st.cache_resource
 def load_llm():
     return ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
+        model=LLM_MODEL,
         google_api_key=GOOGLE_API_KEY
     )
 
@@ -171,17 +226,67 @@ def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
         start += size - overlap
     return chunks
 
+# ── openFDA ───────────────────────────────────────────────────────────────────
+OPENFDA_LABEL_URL = "https://api.fda.gov/drug/label.json"
+# on-disk response cache: readwrite | replay (cache only, no network) | off
+OPENFDA_CACHE_MODE = os.environ.get("OPENFDA_CACHE_MODE", "readwrite")
+OPENFDA_CACHE_DIR = os.environ.get("OPENFDA_CACHE_DIR", ".openfda_cache")
+OPENFDA_CACHE_TTL_SECONDS = int(os.environ.get("OPENFDA_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+def write_openfda_cache(path, entry):
+    os.makedirs(OPENFDA_CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+def openfda_get(client, params):
+    # same cache files as backend/openfda.py, so either side can replay what the other fetched;
+    # returns (status, json body)
+    key = json.dumps(params, sort_keys=True)
+    path = os.path.join(OPENFDA_CACHE_DIR, hashlib.sha256(key.encode()).hexdigest() + ".json")
+    entry = None
+    if OPENFDA_CACHE_MODE != "off" and os.path.exists(path):
+        with open(path) as f:
+            entry = json.load(f)
+    if entry and (OPENFDA_CACHE_MODE == "replay" or time.time() - entry["fetched_at"] < OPENFDA_CACHE_TTL_SECONDS):
+        return entry["status"], json.loads(entry["body"])
+    if OPENFDA_CACHE_MODE == "replay":
+        return 504, {}
+
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        resp = client.get(OPENFDA_LABEL_URL, params=params, headers=headers)
+    except httpx.TransportError:
+        if entry:
+            return entry["status"], json.loads(entry["body"])
+        raise
+    if resp.status_code == 304 and entry:
+        entry["fetched_at"] = time.time()
+    elif resp.status_code in (200, 404):  # 404 is openFDA's "no matches"
+        entry = {"params": params, "status": resp.status_code, "body": resp.text,
+                 "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified"),
+                 "fetched_at": time.time()}
+    elif not entry:
+        return resp.status_code, {}
+    if OPENFDA_CACHE_MODE != "off":
+        write_openfda_cache(path, entry)
+    return entry["status"], json.loads(entry["body"])
+
 # ── Core Logic ─────────────────────────────────────────────────────────────────
 def fetch_and_store_label(drug_name):
-    url = "https://api.fda.gov/drug/label.json"
-    with httpx.Client() as client:
-        resp = client.get(url, params={"search": f"openfda.generic_name:{drug_name}", "limit": 1})
-        if resp.status_code != 200 or not resp.json().get("results"):
-            resp = client.get(url, params={"search": f"openfda.brand_name:{drug_name}", "limit": 1})
-        if resp.status_code != 200:
+    with httpx.Client(timeout=30) as client:
+        status, data = openfda_get(client, {"search": f"openfda.generic_name:{drug_name}", "limit": 1})
+        if status != 200 or not data.get("results"):
+            status, data = openfda_get(client, {"search": f"openfda.brand_name:{drug_name}", "limit": 1})
+        if status != 200:
             return None, "Could not fetch label from FDA API."
 
-    results = resp.json().get("results", [])
+    results = data.get("results", [])
     if not results:
         return None, "No label found for this drug."
 
@@ -206,7 +311,7 @@ def fetch_and_store_label(drug_name):
             all_chunks.append((section, i, chunk))
     save_chunks(label_id, all_chunks)
 
-    chunks_to_embed = get_chunks_without_embeddings()
+    chunks_to_embed = get_chunks_without_embeddings(label_id)
     for chunk in chunks_to_embed:
         embedding = get_embedding(chunk["content"])
         save_embedding(chunk["id"], embedding)
@@ -216,16 +321,15 @@ def fetch_and_store_label(drug_name):
 
 def rag_search(q, k=5, label_id=None):
     query_embedding = get_query_embedding(q)
-    emb_str = "[" + ",".join([str(float(x)) for x in query_embedding]) + "]"
     label_filter = "AND label_id = :label_id" if label_id else ""
-    params = {"emb": emb_str, "k": k}
+    params = {"emb": to_vector(query_embedding), "k": k}
     if label_id:
         params["label_id"] = label_id
 
     with engine.connect() as conn:
         rows = conn.execute(text(f"""
             SELECT id, label_id, section, chunk_index, content,
-                   embedding <=> CAST(:emb AS vector) AS distance
+                   embedding <=> :emb AS distance
             FROM label_chunks
             WHERE embedding IS NOT NULL {label_filter}
             ORDER BY distance ASC LIMIT :k;
@@ -238,23 +342,100 @@ def rag_search(q, k=5, label_id=None):
         used_fallback = True
         with engine.connect() as conn:
             fb_rows = conn.execute(text(f"""
-                SELECT id, label_id, section, chunk_index, content, 0.60 AS distance
-                FROM label_chunks
-                WHERE to_tsvector('english', content) @@ plainto_tsquery('english', :q)
-                {label_filter} LIMIT :k;
+                SELECT id, label_id, section, chunk_index, content,
+                       ts_rank_cd(content_tsv, query, 32) AS rank
+                FROM label_chunks, plainto_tsquery('english', :q) AS query
+                WHERE content_tsv @@ query {label_filter}
+                ORDER BY rank DESC LIMIT :k;
             """), {**params, "q": q}).mappings().all()
         if fb_rows:
             matches = [dict(r) for r in fb_rows]
 
     return matches, used_fallback
 
-def generate_answer(q, matches, llm):
-    rewrite_prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an FDA medical terminology expert. Rewrite the user question using clinical FDA label language for better document retrieval. Return only the rewritten query, nothing else."),
-        ("human", "{question}")
-    ])
-    rewritten_q = (rewrite_prompt | llm).invoke({"question": q}).content.strip()
+REWRITE_TTL_SECONDS = int(os.environ.get("REWRITE_TTL_SECONDS", str(30 * 24 * 3600)))
+REWRITE_CACHE_SIZE = int(os.environ.get("REWRITE_CACHE_SIZE", "4096"))
+REWRITE_MAX_ROWS = int(os.environ.get("REWRITE_MAX_ROWS", "100000"))
+
+REWRITE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an FDA medical terminology expert. Rewrite the user question using clinical FDA label language for better document retrieval. Return only the rewritten query, nothing else."),
+    ("human", "{question}")
+])
+
+def normalize_question(q):
+    # case, spacing and trailing punctuation don't change what the rewrite should be
+    return " ".join(q.lower().split()).rstrip("?!. ")
 
+def stored_rewrite(question, q, llm):
+    # same query_rewrites table as the backend; returns (rewritten, age in seconds)
+    params = {"question": question, "model": LLM_MODEL, "ttl": REWRITE_TTL_SECONDS}
+    with engine.begin() as conn:
+        row = conn.execute(text("""
+            UPDATE query_rewrites SET last_used_at = NOW()
+            WHERE question = :question AND model = :model
+              AND created_at > NOW() - make_interval(secs => :ttl)
+            RETURNING rewritten, EXTRACT(EPOCH FROM NOW() - created_at) AS age;
+        """), params).fetchone()
+    if row:
+        return row.rewritten, float(row.age)
+
+    rewritten = (REWRITE_PROMPT | llm).invoke({"question": q}).content.strip()
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO query_rewrites (question, model, rewritten)
+            VALUES (:question, :model, :rewritten)
+            ON CONFLICT (question, model) DO UPDATE
+            SET rewritten = EXCLUDED.rewritten, created_at = NOW(), last_used_at = NOW();
+        """), {**params, "rewritten": rewritten})
+        conn.execute(text("""
+            DELETE FROM query_rewrites
+            WHERE created_at < NOW() - make_interval(secs => :ttl)
+               OR last_used_at <= (SELECT last_used_at FROM query_rewrites
+                                  ORDER BY last_used_at DESC OFFSET :max_rows LIMIT 1);
+        """), {"ttl": REWRITE_TTL_SECONDS, "max_rows": REWRITE_MAX_ROWS})
+    return rewritten, 0.0
+
+class LRUCache:
+    # thread-safe, size-bounded LRU, same shape as the one in ui/app.py
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                return self.data[key]
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+@st.cache_resource
+def load_rewrite_cache():
+    return LRUCache(REWRITE_CACHE_SIZE)
+
+def rewrite_question(q, llm):
+    # in-process copy of query_rewrites keyed by (model, question), like ui/app.py; both expire
+    # REWRITE_TTL_SECONDS after the rewrite was generated
+    question = normalize_question(q)
+    key = (LLM_MODEL, question)
+    cache = load_rewrite_cache()
+    hit = cache.get(key)
+    if hit and hit[1] > time.time():
+        return hit[0]
+    rewritten, age = stored_rewrite(question, q, llm)
+    cache.put(key, (rewritten, time.time() + REWRITE_TTL_SECONDS - age))
+    return rewritten
+
+def generate_answer(q, matches, llm):
     evidence_block = ""
     for i, m in enumerate(matches):
         evidence_block += f"[{i+1}] Section: {m['section']}\n{m['content']}\n\n"
@@ -365,7 +546,9 @@ if st.button("Get Answer"):
     label_id = label_data.get("label_id")
 
     with st.spinner("Searching and generating answer..."):
-        matches, used_fallback = rag_search(question, k=top_k, label_id=label_id)
+        # retrieve with the clinical rewrite, answer the question as asked
+        rewritten_q = rewrite_question(question, llm)
+        matches, used_fallback = rag_search(rewritten_q, k=top_k, label_id=label_id)
         if not matches:
             st.warning("No relevant information found.")
             st.stop()
@@ -390,9 +573,14 @@ if st.button("Get Answer"):
         for c in matches:
             section = c.get("section", "unknown")
             dist = c.get("distance")
-            dist_str = f"{float(dist):.4f}" if dist is not None else "—"
             chunk_id = c.get("id", "?")
-            dist_color = "#2a9d6e" if dist and float(dist) < 0.4 else "#c97c2a" if dist and float(dist) < 0.6 else "#c0392b"
+            if dist is None and c.get("rank") is not None:
+                # keyword fallback: a text-search rank, not a distance, so no quality colouring
+                dist_label, dist_str, dist_color = "rank", f"{float(c['rank']):.4f}", "#b0a99f"
+            else:
+                dist_label = "dist"
+                dist_str = f"{float(dist):.4f}" if dist is not None else "—"
+                dist_color = "#2a9d6e" if dist and float(dist) < 0.4 else "#c97c2a" if dist and float(dist) < 0.6 else "#c0392b"
 
             st.markdown(f"""
             <div style="background:#ffffff;border:1.5px solid #e2ddd6;border-radius:12px;overflow:hidden;margin-bottom:10px;">
@@ -401,7 +589,7 @@ if st.button("Get Answer"):
                   <span style="font-family:'JetBrains Mono',monospace;font-size:11px;color:#4a6cf7;font-weight:500;">[{chunk_id}]</span>
                   <span style="font-size:10px;font-family:'JetBrains Mono',monospace;background:#eef1fe;border:1px solid #d0d8fc;color:#4a6cf7;padding:2px 8px;border-radius:4px;">{section}</span>
                 </div>
-                <span style="font-family:'JetBrains Mono',monospace;font-size:10px;color:#b0a99f;">dist <span style="color:{dist_color};">{dist_str}</span></span>
+                <span style="font-family:'JetBrains Mono',monospace;font-size:10px;color:#b0a99f;">{dist_label} <span style="color:{dist_color};">{dist_str}</span></span>
               </div>
             </div>
             """, unsafe_allow_html=True)
@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+from collections import Counter
+from langchain_core.prompts import ChatPromptTemplate
+from db import get_cached_answer, save_cached_answer, find_similar_answer
+from rewrite import normalize_question
+
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ROWS = int(os.getenv("ANSWER_CACHE_MAX_ROWS", "50000"))
+# reuse a label-scoped answer when the new question embedding is this close (cosine distance)
+# to a cached one for the same label version; off by default, since questions that differ in
+# one clinically decisive word (pregnancy vs breastfeeding, child vs adult dose) embed close together
+SEMANTIC_CACHE_MAX_DISTANCE = float(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE", "0"))
+
+ANSWER_SYSTEM_PROMPT = """You are a friendly, helpful medical information assistant explaining FDA drug labels to everyday people with no medical background.
+
+Your job is to answer the user's question in clear, simple English that anyone can understand — no jargon.
+- Explain what the FDA label says in plain words
+- If something is a risk, explain WHY it is a risk in simple terms
+- If the answer is "consult a doctor", explain what specifically to ask the doctor about
+- Use short paragraphs, not bullet points
+- Always cite which chunk number(s) your answer comes from using [1], [2] etc.
+- Use ONLY the evidence provided. Do not use outside knowledge.
+- If the evidence does not contain the answer, say what IS known from the label instead of just saying not found.
+"""
+ANSWER_HUMAN_PROMPT = "Question: {question}\n\nEvidence:\n{evidence}"
+
+ANSWER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", ANSWER_SYSTEM_PROMPT),
+    ("human", ANSWER_HUMAN_PROMPT)
+])
+# editing the prompt changes the version, so answers from the old prompt are never served
+PROMPT_VERSION = hashlib.sha256((ANSWER_SYSTEM_PROMPT + ANSWER_HUMAN_PROMPT).encode()).hexdigest()[:12]
+
+answer_sources = Counter()
+
+def answer_key(question, label_id, chunk_ids, model_name):
+    # label_id pins the label version; chunk ids pin the evidence and its order
+    raw = json.dumps([question, label_id, chunk_ids, PROMPT_VERSION, model_name])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def build_citations(matches):
+    # keyword fallback matches have no distance; they carry their tsvector rank or BM25 score instead
+    citations = []
+    for m in matches:
+        citation = {
+            "id": m["id"],
+            "label_id": m["label_id"],
+            "section": m["section"],
+            "chunk_index": m["chunk_index"],
+            "distance": float(m["distance"]) if m.get("distance") is not None else None,
+        }
+        for score in ("rank", "bm25_score"):
+            if m.get(score) is not None:
+                citation[score] = round(float(m[score]), 4)
+        citations.append(citation)
+    return citations
+
+async def similar_answer(model_name, label_id, question_embedding):
+    # paraphrase of a question already answered for this label version; None when there is none
+    if not label_id or SEMANTIC_CACHE_MAX_DISTANCE <= 0:
+        return None
+    hit = await find_similar_answer(label_id, question_embedding, model_name, PROMPT_VERSION,
+                                    ANSWER_CACHE_TTL_SECONDS, SEMANTIC_CACHE_MAX_DISTANCE)
+    if hit is None:
+        return None
+    answer_sources["semantic"] += 1
+    return {**hit["response"], "cached": True,
+            "cache_match": {"question": hit["question"], "distance": round(hit["distance"], 4)}}
+
+def build_evidence(matches):
+    evidence_block = ""
+    for i, m in enumerate(matches):
+        evidence_block += f"[{i+1}] Section: {m['section']}\n{m['content']}\n\n"
+    return evidence_block
+
+async def cache_answer(key, model_name, question, label_id, matches, response, question_embedding=None):
+    label_ids = sorted({m["label_id"] for m in matches})
+    await save_cached_answer(key, label_ids, [m["id"] for m in matches], question, model_name,
+                             PROMPT_VERSION, response, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ROWS,
+                             scope_label_id=label_id,
+                             question_embedding=question_embedding if label_id else None)
+
+async def answer_question(llm, model_name, q, label_id, matches, used_fallback, question_embedding=None):
+    question = normalize_question(q)
+    key = answer_key(question, label_id, [m["id"] for m in matches], model_name)
+    cached = await get_cached_answer(key, ANSWER_CACHE_TTL_SECONDS)
+    if cached:
+        answer_sources["cache"] += 1
+        return {**cached, "cached": True}
+
+    answer = (await (ANSWER_PROMPT | llm).ainvoke({"question": q, "evidence": build_evidence(matches)})).content
+    answer_sources["llm"] += 1
+
+    response = {"answer": answer, "citations": build_citations(matches), "used_fallback": used_fallback}
+    await cache_answer(key, model_name, question, label_id, matches, response, question_embedding)
+    return {**response, "cached": False}
+
+async def stream_answer(llm, model_name, q, label_id, matches, used_fallback, question_embedding=None):
+    # yields (text, cached) as the LLM produces the answer, or once with the whole cached answer;
+    # the full answer is cached only if the stream runs to the end (a client that disconnects
+    # closes the generator first)
+    question = normalize_question(q)
+    key = answer_key(question, label_id, [m["id"] for m in matches], model_name)
+    cached = await get_cached_answer(key, ANSWER_CACHE_TTL_SECONDS)
+    if cached:
+        answer_sources["cache"] += 1
+        yield cached["answer"], True
+        return
+
+    parts = []
+    async for chunk in (ANSWER_PROMPT | llm).astream({"question": q, "evidence": build_evidence(matches)}):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield chunk.content, False
+    answer_sources["llm"] += 1
+
+    response = {"answer": "".join(parts), "citations": build_citations(matches), "used_fallback": used_fallback}
+    await cache_answer(key, model_name, question, label_id, matches, response, question_embedding)
+
+def answer_stats():
+    served = sum(answer_sources.values())
+    saved = answer_sources["cache"] + answer_sources["semantic"]
+    return {
+        "served_from": dict(answer_sources),
+        "llm_calls_saved": saved,
+        "hit_rate": round(saved / served, 3) if served else 0.0,
+    }
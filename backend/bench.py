@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import struct
+import time
+import httpx
+import numpy as np
+from sqlalchemy import text
+from db import engine, to_vector
+from bm25 import BM25Index
+from embed import load_encoder, EMBED_BACKENDS
+
+def per_call_us(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+def vector_to_text(vec):
+    # what save_embedding / rag_search used to send
+    return "[" + ",".join([str(float(x)) for x in vec]) + "]"
+
+def vector_to_binary(vec):
+    # pgvector binary wire format: dim, unused, then big-endian float32 values
+    vec = to_vector(vec)
+    return struct.pack(">HH", vec.shape[0], 0) + vec.astype(">f4").tobytes()
+
+def bench_vector(n=2000, dim=384, with_db=True):
+    vec = np.random.default_rng(0).standard_normal(dim).astype(np.float32)
+    vec /= np.linalg.norm(vec)
+
+    print(f"\nVector parameter encoding, dim={dim}, {n} iterations\n")
+    text_us = per_call_us(lambda: vector_to_text(vec), n)
+    binary_us = per_call_us(lambda: vector_to_binary(vec), n)
+    print(f"  client encode  text literal : {text_us:8.1f} µs/vector ({len(vector_to_text(vec))} bytes)")
+    print(f"  client encode  binary       : {binary_us:8.1f} µs/vector ({len(vector_to_binary(vec))} bytes)")
+
+    if not with_db:
+        return
+
+    # same statement both times; only the parameter type differs (text literal vs binary vector)
+    stmt = text("SELECT vector_dims(CAST(:emb AS vector));")
+    with engine.connect() as conn:
+        text_rt = per_call_us(lambda: conn.execute(stmt, {"emb": vector_to_text(vec)}).scalar(), n)
+        binary_rt = per_call_us(lambda: conn.execute(stmt, {"emb": vec}).scalar(), n)
+    print(f"  round trip     text + parse : {text_rt:8.1f} µs/query")
+    print(f"  round trip     binary       : {binary_rt:8.1f} µs/query")
+    print(f"  speedup                     : {text_rt / binary_rt:8.2f}x")
+
+KEYWORD_QUESTIONS = ["liver damage warnings", "dose for kidney impairment", "use during pregnancy",
+                     "serious allergic reactions", "drug interactions with blood thinners",
+                     "stomach bleeding risk", "overdose symptoms", "children under 12"]
+
+def bench_bm25(labels=5, k=5, reps=200):
+    # label-scoped keyword search: in-process BM25 vs the tsvector query it replaces
+    with engine.connect() as conn:
+        label_ids = conn.execute(text("""
+            SELECT label_id FROM label_chunks GROUP BY label_id ORDER BY count(*) DESC LIMIT :n;
+        """), {"n": labels}).scalars().all()
+        tsvector = text("""
+            SELECT id FROM label_chunks, plainto_tsquery('english', :q) AS query
+            WHERE content_tsv @@ query AND label_id = :label_id
+            ORDER BY ts_rank_cd(content_tsv, query, 32) DESC
+            LIMIT :k;
+        """)
+
+        print(f"\nLabel-scoped keyword search, {len(label_ids)} labels x {len(KEYWORD_QUESTIONS)} questions, k={k}\n")
+        build_ms, nbytes, bm25_us, sql_us, overlap = [], [], [], [], []
+        for label_id in label_ids:
+            chunks = [dict(r) for r in conn.execute(text("""
+                SELECT id, label_id, section, chunk_index, content FROM label_chunks
+                WHERE label_id = :label_id ORDER BY id;
+            """), {"label_id": label_id}).mappings().all()]
+            start = time.perf_counter()
+            index = BM25Index(chunks)
+            build_ms.append((time.perf_counter() - start) * 1000)
+            nbytes.append(index.nbytes)
+            for q in KEYWORD_QUESTIONS:
+                params = {"q": q, "label_id": label_id, "k": k}
+                bm25_us.append(per_call_us(lambda: index.search(q, k), reps))
+                sql_us.append(per_call_us(lambda: conn.execute(tsvector, params).all(), max(1, reps // 10)))
+                bm25_ids = {chunks[d]["id"] for d, _ in index.search(q, k)}
+                sql_ids = set(conn.execute(tsvector, params).scalars().all())
+                if bm25_ids or sql_ids:
+                    overlap.append(len(bm25_ids & sql_ids) / len(bm25_ids | sql_ids))
+
+    print(f"  index build        : {np.mean(build_ms):8.1f} ms/label, {np.mean(nbytes) / 1024:.0f} KB/label")
+    print(f"  bm25 in-process    : {np.median(bm25_us):8.1f} µs/query (p50)")
+    print(f"  tsvector round trip: {np.median(sql_us):8.1f} µs/query (p50)")
+    print(f"  speedup            : {np.median(sql_us) / np.median(bm25_us):8.1f}x")
+    if overlap:
+        print(f"  top-k overlap      : {np.mean(overlap):8.2f} (Jaccard of chunk ids, queries with any hits)")
+
+def bench_encoder(backends, n=512, batch_size=64):
+    # load time, bulk throughput and single-query latency per encoder backend, and how close
+    # each backend's vectors are to the first one's (cosine similarity over the same texts)
+    with engine.connect() as conn:
+        texts = conn.execute(text("SELECT content FROM label_chunks ORDER BY id LIMIT :n;"),
+                             {"n": n}).scalars().all()
+    if not texts:
+        texts = (KEYWORD_QUESTIONS * (n // len(KEYWORD_QUESTIONS) + 1))[:n]
+
+    print(f"\nSentence encoder backends, {len(texts)} chunks, batch size {batch_size}\n")
+    print(f"  {'backend':<10}  {'load s':>6}  {'texts/s':>8}  {'query p50 ms':>12}  {'p95 ms':>7}  "
+          f"{'cos mean':>8}  {'cos min':>8}")
+    reference = None
+    for backend in backends:
+        start = time.perf_counter()
+        model = load_encoder(backend)
+        load_s = time.perf_counter() - start
+        model.encode(texts[:batch_size], batch_size=batch_size)
+
+        start = time.perf_counter()
+        embs = np.asarray(model.encode(texts, batch_size=batch_size, normalize_embeddings=True))
+        rate = len(texts) / (time.perf_counter() - start)
+
+        latencies = []
+        for q in KEYWORD_QUESTIONS * 5:
+            start = time.perf_counter()
+            model.encode(q, normalize_embeddings=True)
+            latencies.append((time.perf_counter() - start) * 1000)
+        p50, p95 = np.percentile(latencies, [50, 95])
+
+        if reference is None:
+            reference, cos = embs, "       —         —"
+        else:
+            sims = (embs * reference).sum(axis=1)
+            cos = f"{sims.mean():8.4f}  {sims.min():8.4f}"
+        print(f"  {backend:<10}  {load_s:6.1f}  {rate:8.1f}  {p50:12.2f}  {p95:7.2f}  {cos}")
+
+async def run_level(client, url, questions, concurrency, n):
+    # n requests, at most `concurrency` in flight; returns wall time and per-request latencies
+    sem = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                resp = await client.get(url, params={"q": questions[i % len(questions)]})
+                if resp.status_code != 200 or "error" in resp.json():
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return time.perf_counter() - start, latencies, errors
+
+async def bench_concurrency(url, levels, n, questions):
+    # run the same load against the server before and after a change to compare them
+    print(f"\nConcurrent load against {url}, {n} requests per level\n")
+    print(f"  {'concurrency':>11}  {'req/s':>8}  {'p50 ms':>8}  {'p95 ms':>8}  {'errors':>6}")
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        # one request first so model loading / cold caches don't land in the first level
+        await client.get(url, params={"q": questions[0]})
+        for c in levels:
+            elapsed, latencies, errors = await run_level(client, url, questions, c, n)
+            p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+            print(f"  {c:>11}  {n / elapsed:8.1f}  {p50:8.1f}  {p95:8.1f}  {errors:>6}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the FDA assistant backend")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("vector", help="text-literal vs binary pgvector parameters")
+    p.add_argument("-n", type=int, default=2000)
+    p.add_argument("--dim", type=int, default=384, help="384 for MiniLM, 768 for app.py")
+    p.add_argument("--no-db", action="store_true", help="client-side encoding only")
+
+    p = sub.add_parser("bm25", help="in-process BM25 vs tsvector for label-scoped keyword search")
+    p.add_argument("--labels", type=int, default=5, help="largest N labels")
+    p.add_argument("-k", type=int, default=5)
+    p.add_argument("-n", type=int, default=200, help="repetitions per query")
+
+    p = sub.add_parser("encoder", help="throughput, latency and parity of the sentence encoder backends")
+    p.add_argument("--backends", default="torch,onnx,onnx-int8", help="comma-separated; the first is the reference")
+    p.add_argument("-n", type=int, default=512, help="stored chunks to encode")
+    p.add_argument("--batch-size", type=int, default=64)
+
+    p = sub.add_parser("concurrency", help="throughput and latency of a running server under concurrent load")
+    p.add_argument("--url", default="http://127.0.0.1:8000/rag/search")
+    p.add_argument("--levels", default="1,16,64", help="comma-separated concurrency levels")
+    p.add_argument("-n", type=int, default=500, help="requests per level")
+    p.add_argument("--questions", help="file with one question per line (default: a few built-in ones)")
+
+    args = parser.parse_args()
+    if args.bench == "vector":
+        bench_vector(args.n, args.dim, with_db=not args.no_db)
+    elif args.bench == "bm25":
+        bench_bm25(args.labels, args.k, args.n)
+    elif args.bench == "encoder":
+        backends = args.backends.split(",")
+        unknown = [b for b in backends if b not in EMBED_BACKENDS]
+        if unknown:
+            parser.error(f"unknown backend(s) {', '.join(unknown)}; choose from {', '.join(EMBED_BACKENDS)}")
+        bench_encoder(backends, args.n, args.batch_size)
+    elif args.bench == "concurrency":
+        if args.questions:
+            with open(args.questions) as f:
+                questions = [line.strip() for line in f if line.strip()]
+        else:
+            questions = ["liver damage warnings", "dose for kidney impairment", "use during pregnancy",
+                         "serious allergic reactions", "drug interactions with blood thinners"]
+        levels = [int(c) for c in args.levels.split(",")]
+        asyncio.run(bench_concurrency(args.url, levels, args.n, questions))
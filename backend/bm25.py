@@ -0,0 +1,102 @@
+import os
+import re
+import asyncio
+import numpy as np
+from cache import ByteLRUCache
+from db import get_label_chunks
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# raw BM25 scores are unbounded and depend on the label, so they get their own cutoff
+BM25_MIN_SCORE = float(os.getenv("BM25_MIN_SCORE", "0"))
+# per-label indexes kept in memory, evicted least recently used first past this size
+BM25_CACHE_MB = int(os.getenv("BM25_CACHE_MB", "64"))
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+    a an and are as at be been but by can could do does for from has have how i if in into is it
+    its may me my no not of on or should so than that the their there these this to was what when
+    where which while who why will with would you your
+""".split())
+SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "ed", "s")
+
+def stem(token):
+    # crude suffix stripping so "warnings"/"warning" and "caused"/"causes"/"cause" share a term
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[:-len(suffix)] + ("y" if suffix == "ies" else "")
+            break
+    return token[:-1] if token.endswith("e") and len(token) > 4 else token
+
+def tokenize(text):
+    return [stem(t) for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+class BM25Index:
+    # postings in CSR form: the docs containing term t are docs[offsets[t]:offsets[t + 1]],
+    # with their term frequencies in the same slice of tfs
+    def __init__(self, chunks, k1=BM25_K1, b=BM25_B):
+        self.chunks = chunks
+        self.k1 = k1
+        self.terms = {}
+        term_col, doc_col, tf_col = [], [], []
+        doc_len = np.zeros(len(chunks), dtype=np.float32)
+        for d, chunk in enumerate(chunks):
+            tokens = tokenize(chunk["content"])
+            doc_len[d] = len(tokens)
+            counts = {}
+            for token in tokens:
+                t = self.terms.setdefault(token, len(self.terms))
+                counts[t] = counts.get(t, 0) + 1
+            term_col.extend(counts)
+            doc_col.extend([d] * len(counts))
+            tf_col.extend(counts.values())
+
+        term_col = np.array(term_col, dtype=np.int32)
+        order = np.argsort(term_col, kind="stable")
+        self.docs = np.array(doc_col, dtype=np.int32)[order]
+        self.tfs = np.array(tf_col, dtype=np.float32)[order]
+        df = np.bincount(term_col, minlength=len(self.terms))
+        self.offsets = np.concatenate([[0], np.cumsum(df)]).astype(np.int32)
+        n = len(chunks)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = doc_len.mean() if n else 0.0
+        # document-length part of the BM25 denominator, fixed once the index is built
+        self.norm = (k1 * (1 - b + b * doc_len / avgdl) if avgdl else np.full(n, k1)).astype(np.float32)
+        self.nbytes = (self.docs.nbytes + self.tfs.nbytes + self.offsets.nbytes + self.idf.nbytes
+                       + self.norm.nbytes + sum(len(t) + 80 for t in self.terms)
+                       + sum(len(c["content"]) + 200 for c in chunks))
+
+    def search(self, query, k):
+        # [(chunk position, score)] best first; only chunks sharing a term with the query
+        term_ids = [self.terms[t] for t in set(tokenize(query)) if t in self.terms]
+        if not term_ids:
+            return []
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for t in term_ids:
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs, tfs = self.docs[start:end], self.tfs[start:end]
+            scores[docs] += self.idf[t] * tfs * (self.k1 + 1) / (tfs + self.norm[docs])
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(int(d), float(scores[d])) for d in hits]
+
+# a label's chunks never change once stored (a new label version gets a new label_id), so
+# entries only leave by eviction
+bm25_cache = ByteLRUCache(BM25_CACHE_MB << 20)
+
+async def label_index(label_id):
+    index = bm25_cache.get(label_id)
+    if index is None:
+        chunks = await get_label_chunks(label_id)
+        index = await asyncio.to_thread(BM25Index, chunks)
+        bm25_cache.put(label_id, index)
+    return index
+
+async def bm25_search(label_id, q, k, min_score=BM25_MIN_SCORE):
+    # label-scoped keyword matches carrying the raw bm25_score; no distance, since a BM25 score
+    # is not on the cosine scale the vector results and their thresholds use
+    index = await label_index(label_id)
+    return [{**index.chunks[d], "bm25_score": score}
+            for d, score in index.search(q, k) if score >= min_score]
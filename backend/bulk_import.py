@@ -0,0 +1,186 @@
+import os
+import io
+import json
+import time
+import zipfile
+import argparse
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from db import init_db
+from embed import load_encoder
+from ingest import parse_label, store_label
+
+# worker processes; each runs its own model with IMPORT_THREADS intra-op threads
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", str(os.cpu_count() or 1)))
+IMPORT_THREADS = int(os.getenv("IMPORT_THREADS", "1"))
+READ_SIZE = 1 << 20
+WHITESPACE = " \t\r\n"
+
+class JsonStream:
+    # incremental reader over a text stream: decodes one JSON value at a time from a rolling
+    # buffer, so only the value being decoded (one label) is ever held in memory
+    def __init__(self, stream, read_size=READ_SIZE):
+        self.stream = stream
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        chunk = self.stream.read(self.read_size)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self, skip=WHITESPACE):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in skip:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r}, got {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, self.pos = self.decoder.raw_decode(self.buf, self.pos)
+                return obj
+            except json.JSONDecodeError:
+                # value runs past the end of the buffer
+                if not self.fill():
+                    raise
+
+def iter_results(stream):
+    # openFDA bulk files are {"meta": {...}, "results": [label, ...]}; meta has its own
+    # "results" key, so walk the top-level object instead of searching for the text
+    js = JsonStream(stream)
+    js.expect("{")
+    while js.peek(WHITESPACE + ",") not in ("}", ""):
+        key = js.value()
+        js.expect(":")
+        if key != "results":
+            js.value()
+            continue
+        js.expect("[")
+        while js.peek(WHITESPACE + ",") not in ("]", ""):
+            yield js.value()
+        js.expect("]")
+
+def iter_zip_labels(path):
+    with zipfile.ZipFile(path) as zf:
+        for member in sorted(n for n in zf.namelist() if n.endswith(".json")):
+            with zf.open(member) as raw:
+                yield from iter_results(io.TextIOWrapper(raw, encoding="utf-8"))
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_checkpoint(path, checkpoint):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, path)
+
+_model = None
+
+def init_worker(threads):
+    global _model
+    _model = load_encoder(threads=threads)
+
+def import_label(r):
+    # runs in a worker: parse, chunk, embed (reusing the store) and write one label
+    label = parse_label(r)
+    if not label["sections"]:
+        return {"status": "skipped"}
+    drug_name = label["generic_name"] or label["brand_name"] or r.get("id", "")
+    summary = store_label(_model, drug_name, r)
+    if summary["cached"]:
+        return {"status": "existing"}
+    report = summary["embedding"]
+    return {"status": "stored", "chunks": report["chunks"], "encoded": report["encoded"]}
+
+def import_files(paths, checkpoint_path, workers=IMPORT_WORKERS, threads=IMPORT_THREADS,
+                 save_every=200, target=None):
+    # labels are submitted in file order and collected in the same order, so the checkpoint
+    # is always a contiguous prefix of each file; at most workers * 4 labels are in flight
+    checkpoint = load_checkpoint(checkpoint_path)
+    totals = Counter()
+    start = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+
+    def collect(state, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"  FAIL label #{state['done']} — {e!r}")
+            result = {"status": "failed"}
+        totals[result["status"]] += 1
+        totals["chunks"] += result.get("chunks", 0)
+        totals["encoded"] += result.get("encoded", 0)
+        state["done"] += 1
+        processed = sum(totals[s] for s in ("stored", "existing", "skipped", "failed"))
+        if processed % save_every == 0:
+            save_checkpoint(checkpoint_path, checkpoint)
+            rate = processed / (time.perf_counter() - start) * 60
+            print(f"  {processed} labels ({totals['stored']} stored, {totals['existing']} existing, "
+                  f"{totals['skipped']} skipped) — {rate:.0f} labels/min")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=init_worker, initargs=(threads,)) as pool:
+        for path in paths:
+            name = os.path.basename(path)
+            state = checkpoint.setdefault(name, {"done": 0, "complete": False})
+            if state["complete"]:
+                print(f"Skipping {name} — already imported")
+                continue
+            print(f"Importing {name} (resuming after {state['done']} labels)" if state["done"]
+                  else f"Importing {name}")
+
+            inflight = deque()
+            for i, r in enumerate(iter_zip_labels(path)):
+                if i < state["done"]:
+                    continue
+                inflight.append(pool.submit(import_label, r))
+                if len(inflight) >= workers * 4:
+                    collect(state, inflight.popleft())
+            while inflight:
+                collect(state, inflight.popleft())
+            state["complete"] = True
+            save_checkpoint(checkpoint_path, checkpoint)
+
+    elapsed = time.perf_counter() - start
+    processed = sum(totals[s] for s in ("stored", "existing", "skipped", "failed"))
+    rate = processed / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"\nDone! {processed} labels in {elapsed:.1f}s ({rate:.0f} labels/min): "
+          f"{totals['stored']} stored, {totals['existing']} already stored, "
+          f"{totals['skipped']} without sections, {totals['failed']} failed")
+    print(f"  {totals['chunks']} chunks, {totals['chunks'] - totals['encoded']} embeddings reused")
+    if target:
+        print(f"  target {target} labels/min: {'met' if rate >= target else 'MISSED'}")
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import openFDA drug-label bulk downloads (drug-label-*.json.zip)")
+    parser.add_argument("files", nargs="+", help="bulk zip files from https://open.fda.gov/data/downloads/")
+    parser.add_argument("--checkpoint", default="import_checkpoint.json", help="progress file used to resume")
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS)
+    parser.add_argument("--threads", type=int, default=IMPORT_THREADS, help="encoder threads per worker")
+    parser.add_argument("--target", type=float, help="labels/minute to report against")
+    args = parser.parse_args()
+
+    init_db(build_index=False)
+    import_files(args.files, args.checkpoint, args.workers, args.threads, target=args.target)
@@ -1,11 +1,20 @@
-import httpx
+import os
 import time
 import asyncio
-from db import init_db, save_label, save_chunks, save_embedding, get_chunks_without_embeddings, engine
+import argparse
+import httpx
+from db import init_db, engine
+from embed import drain_embeddings, load_encoder
+from ingest import parse_label, store_label
+from openfda import fetch_label, openfda_limiter
 from sqlalchemy import text
-from sentence_transformers import SentenceTransformer
 
-model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+model = load_encoder()
+
+# in-flight openFDA requests; the token bucket in openfda.py keeps the overall rate in bounds
+BULK_FETCH_CONCURRENCY = int(os.getenv("BULK_FETCH_CONCURRENCY", "8"))
+# threads chunking/embedding/storing fetched labels; the model already uses every core
+BULK_STORE_WORKERS = int(os.getenv("BULK_STORE_WORKERS", "1"))
 
 DRUGS = [
     "ibuprofen", "acetaminophen", "aspirin", "metformin", "atorvastatin",
@@ -18,89 +27,90 @@ DRUGS = [
     "zolpidem", "cyclobenzaprine", "naproxen", "meloxicam", "doxycycline"
 ]
 
-SECTIONS = [
-    "adverse_reactions", "boxed_warning", "contraindications",
-    "dosage_and_administration", "drug_interactions", "precautions",
-    "use_in_specific_populations", "warnings", "warnings_and_cautions"
-]
-
-CHUNK_SIZE = 900
-CHUNK_OVERLAP = 120
-
-def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    chunks = []
-    start = 0
-    while start < len(text):
-        chunks.append(text[start:start+size])
-        start += size - overlap
-    return chunks
-
-async def fetch_label(drug_name):
-    url = "https://api.fda.gov/drug/label.json"
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.get(url, params={"search": f"openfda.generic_name:{drug_name}", "limit": 1})
-        if resp.status_code != 200 or not resp.json().get("results"):
-            resp = await client.get(url, params={"search": f"openfda.brand_name:{drug_name}", "limit": 1})
-        if resp.status_code != 200:
-            return None
-        results = resp.json().get("results", [])
-        if not results:
-            return None
-        return results[0]
-
-async def process_drug(drug_name):
-    print(f"  Fetching {drug_name}...")
-    r = await fetch_label(drug_name)
+def process_drug(drug_name, r, error):
+    # consumer side: runs in a worker thread so encoding never blocks the fetchers
     if not r:
-        print(f"  SKIP {drug_name} — not found")
+        print(f"  SKIP {drug_name} — {error or 'not found'}")
         return False
 
-    openfda = r.get("openfda", {})
-    brand_name    = openfda.get("brand_name", [""])[0]
-    generic_name  = openfda.get("generic_name", [""])[0]
-    manufacturer  = openfda.get("manufacturer_name", [""])[0]
-    effective_time = r.get("effective_time", "")
-
-    sections = {}
-    for s in SECTIONS:
-        val = r.get(s)
-        if val:
-            sections[s] = val[0] if isinstance(val, list) else val
-
-    if not sections:
+    if not parse_label(r)["sections"]:
         print(f"  SKIP {drug_name} — no sections")
         return False
 
-    label_id = save_label(drug_name, brand_name, generic_name, manufacturer, effective_time, sections, r)
-
-    all_chunks = []
-    for section, content in sections.items():
-        for i, chunk in enumerate(chunk_text(content)):
-            all_chunks.append((section, i, chunk))
-    save_chunks(label_id, all_chunks)
+    summary = store_label(model, drug_name, r)
+    if summary["cached"]:
+        print(f"  OK {drug_name} — already stored, label_id={summary['label_id']}")
+        return True
 
-    print(f"  OK {drug_name} — {len(sections)} sections, {len(all_chunks)} chunks, label_id={label_id}")
+    report = summary["embedding"]
+    print(f"  OK {drug_name} — {len(summary['sections_found'])} sections, {report['chunks']} chunks, "
+          f"label_id={summary['label_id']} ({report['chunks_per_sec']} chunks/sec, "
+          f"{report['hit_rate']:.0%} reused)")
     return True
 
-async def main():
+async def fetch_worker(pending, fetched, client, limiter):
+    while True:
+        try:
+            drug = pending.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        try:
+            r, error = await fetch_label(drug, client, limiter)
+        except httpx.HTTPError as e:
+            r, error = None, f"fetch failed: {e!r}"
+        await fetched.put((drug, r, error))
+
+async def store_worker(fetched, results):
+    while True:
+        item = await fetched.get()
+        try:
+            if item is None:
+                return
+            try:
+                ok = await asyncio.to_thread(process_drug, *item)
+            except Exception as e:
+                # one bad label is recorded as failed instead of taking the consumer down
+                print(f"  FAIL {item[0]} — {e!r}")
+                ok = False
+            results.append(ok)
+        finally:
+            fetched.task_done()
+
+async def main(drugs, concurrency=BULK_FETCH_CONCURRENCY, store_workers=BULK_STORE_WORKERS):
     init_db()
-    print(f"\nLoading {len(DRUGS)} drugs...\n")
-
-    for drug in DRUGS:
-        await process_drug(drug)
-        time.sleep(0.5)  
-
-    print("\nEmbedding all chunks without embeddings...")
-    chunks = get_chunks_without_embeddings()
-    print(f"Found {len(chunks)} chunks to embed")
-
-    for i, chunk in enumerate(chunks):
-        embedding = model.encode(chunk["content"], normalize_embeddings=True)
-        save_embedding(chunk["id"], embedding)
-        if (i + 1) % 50 == 0:
-            print(f"  Embedded {i+1}/{len(chunks)}")
-
-    print(f"\nDone! All {len(chunks)} chunks embedded.")
+    print(f"\nLoading {len(drugs)} drugs ({concurrency} fetchers, {store_workers} store workers)...\n")
+    start = time.perf_counter()
+
+    # fetchers fill a bounded queue that the store workers drain, so the network stays busy
+    # while labels are chunked and embedded, and memory stays flat on long lists
+    pending = asyncio.Queue()
+    for drug in drugs:
+        pending.put_nowait(drug)
+    fetched = asyncio.Queue(maxsize=concurrency * 2)
+    results = []
+    limiter = openfda_limiter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+        # a task group cancels the fetchers if a store worker dies, so they never block
+        # forever on a full queue nobody drains
+        async with asyncio.TaskGroup() as tg:
+            stores = [tg.create_task(store_worker(fetched, results)) for _ in range(store_workers)]
+            fetchers = [tg.create_task(fetch_worker(pending, fetched, client, limiter))
+                        for _ in range(concurrency)]
+            await asyncio.gather(*fetchers)
+            for _ in stores:
+                await fetched.put(None)
+
+    elapsed = time.perf_counter() - start
+    print(f"\nStored {sum(results)}/{len(drugs)} drugs in {elapsed:.1f}s "
+          f"({len(drugs) / elapsed * 60:.0f} drugs/min)")
+
+    print("\nEmbedding any chunks left without embeddings...")
+    report = drain_embeddings(model, log=lambda done: print(f"  Embedded {done}"))
+
+    print(f"\nDone! {report['chunks']} backlog chunks embedded "
+          f"in {report['seconds']}s ({report['chunks_per_sec']} chunks/sec, "
+          f"{report['reused']} reused from the embedding store).")
 
     with engine.connect() as conn:
         label_count = conn.execute(text("SELECT COUNT(*) FROM drug_labels")).scalar()
@@ -111,4 +121,15 @@ async def main():
     print(f"  Chunks : {chunk_count}")
     print(f"  Embedded: {embedded_count}")
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load openFDA labels")
+    parser.add_argument("drugs_file", nargs="?", help="one drug name per line (default: built-in list)")
+    parser.add_argument("--concurrency", type=int, default=BULK_FETCH_CONCURRENCY)
+    parser.add_argument("--store-workers", type=int, default=BULK_STORE_WORKERS)
+    args = parser.parse_args()
+
+    drugs = DRUGS
+    if args.drugs_file:
+        with open(args.drugs_file) as f:
+            drugs = [line.strip() for line in f if line.strip()]
+    asyncio.run(main(drugs, args.concurrency, args.store_workers))
\ No newline at end of file
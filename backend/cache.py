@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class LRUCache:
+    # thread-safe, size-bounded LRU; shared by the request threads of one process
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def items(self):
+        # least recently used first, so reloading them in order keeps the recency order
+        with self.lock:
+            return list(self.data.items())
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+class ByteLRUCache(LRUCache):
+    # LRU bounded by the total size of its values (anything with an nbytes attribute)
+    def __init__(self, maxbytes):
+        super().__init__(maxsize=None)
+        self.maxbytes = maxbytes
+        self.bytes = 0
+
+    def put(self, key, value):
+        if value.nbytes > self.maxbytes:
+            return
+        with self.lock:
+            old = self.data.pop(key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            self.data[key] = value
+            self.bytes += value.nbytes
+            while self.bytes > self.maxbytes:
+                _, evicted = self.data.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def pop(self, key):
+        with self.lock:
+            value = self.data.pop(key, None)
+            if value is not None:
+                self.bytes -= value.nbytes
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        stats = super().stats()
+        del stats["maxsize"]
+        with self.lock:
+            stats.update(bytes=self.bytes, maxbytes=self.maxbytes)
+        return stats
+
+def save_embedding_cache(cache, path, model_name):
+    # plain arrays (no pickle); the model name guards against loading another model's vectors
+    items = cache.items()
+    if not items:
+        return 0
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp, model=np.array(model_name), keys=np.array([k for k, _ in items]),
+             embeddings=np.stack([v for _, v in items]))
+    os.replace(tmp, path)
+    return len(items)
+
+def load_embedding_cache(cache, path, model_name):
+    if not path or not os.path.exists(path):
+        return 0
+    with np.load(path, allow_pickle=False) as f:
+        if str(f["model"]) != model_name:
+            return 0
+        keys, embeddings = f["keys"], f["embeddings"]
+    for key, emb in zip(keys, embeddings):
+        emb.flags.writeable = False
+        cache.put(str(key), emb)
+    return len(keys)
@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from cache import LRUCache
+from db import save_embeddings, content_hash, get_known_hashes, reuse_embeddings, get_chunks_without_embeddings
+from vector_cache import invalidate_label
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+# encoder runtime: torch | onnx | onnx-int8 (the onnx ones need requirements-onnx.txt)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_BACKENDS = ("torch", "onnx", "onnx-int8")
+# quantized file inside the model repo; pick the build for the CPU (avx2, avx512, avx512_vnni, arm64)
+EMBED_ONNX_INT8_FILE = os.getenv("EMBED_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# normalized query text -> embedding; QUERY_CACHE_PATH keeps it across restarts
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")
+
+def embed_key(backend=EMBED_BACKEND, model_name=EMBED_MODEL):
+    # key of the embedding store and the saved query cache: torch and onnx run the same fp32
+    # weights and share stored vectors, int8 vectors are kept apart
+    return f"{model_name}@int8" if backend == "onnx-int8" else model_name
+
+EMBED_KEY = embed_key()
+
+def load_encoder(backend=EMBED_BACKEND, model_name=EMBED_MODEL, threads=None):
+    # a SentenceTransformer on CPU whatever the runtime, so callers only ever use .encode();
+    # threads caps intra-op threads for this process (e.g. one per bulk_import worker)
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name, device="cpu")
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"EMBED_BACKEND must be one of {', '.join(EMBED_BACKENDS)}, got {backend!r}")
+    model_kwargs = {"provider": "CPUExecutionProvider"}
+    if backend == "onnx-int8":
+        model_kwargs["file_name"] = EMBED_ONNX_INT8_FILE
+    if threads:
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = threads
+        model_kwargs["session_options"] = session_options
+    return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+query_cache = LRUCache(QUERY_CACHE_SIZE)
+
+def normalize_query(q):
+    # all-MiniLM-L6-v2 lowercases and splits on whitespace anyway, so this never changes its embedding
+    return " ".join(q.lower().split())
+
+# query encoding off the event loop: a few dedicated threads, so a burst of requests queues
+# here instead of starving the default executor (torch releases the GIL while encoding)
+ENCODE_THREADS = int(os.getenv("ENCODE_THREADS", "2"))
+encode_executor = ThreadPoolExecutor(max_workers=ENCODE_THREADS, thread_name_prefix="encode")
+
+def _encode_query(model, key):
+    emb = model.encode(key, normalize_embeddings=True)
+    emb.flags.writeable = False
+    query_cache.put(key, emb)
+    return emb
+
+async def aencode_query(model, q):
+    # cache hits stay on the event loop; only misses go to the encode threads
+    key = normalize_query(q)
+    emb = query_cache.get(key)
+    if emb is not None:
+        return emb
+    return await asyncio.get_running_loop().run_in_executor(encode_executor, _encode_query, model, key)
+
+def encode_queries(model, qs, batch_size=EMBED_BATCH_SIZE):
+    # many queries at once: cache hits are reused, the misses go through one model.encode call
+    keys = [normalize_query(q) for q in qs]
+    found = {key: query_cache.get(key) for key in set(keys)}
+    missing = [key for key, emb in found.items() if emb is None]
+    if missing:
+        for key, emb in zip(missing, model.encode(missing, batch_size=batch_size, normalize_embeddings=True)):
+            emb.flags.writeable = False
+            query_cache.put(key, emb)
+            found[key] = emb
+    return [found[key] for key in keys]
+
+async def aencode_queries(model, qs):
+    return await asyncio.get_running_loop().run_in_executor(encode_executor, encode_queries, model, qs)
+
+def encode_texts(model, texts, batch_size=EMBED_BATCH_SIZE, log=None):
+    # encode `batch_size` texts per model call; returns embeddings in input order plus a report
+    start = time.perf_counter()
+    embeddings = []
+    for i in range(0, len(texts), batch_size):
+        embeddings.extend(model.encode(texts[i:i + batch_size], batch_size=batch_size,
+                                       normalize_embeddings=True))
+        if log:
+            log(len(embeddings), len(texts))
+    return embeddings, embed_stats(len(texts), time.perf_counter() - start)
+
+def encode_unseen(model, texts, batch_size=EMBED_BATCH_SIZE, log=None):
+    # only text with no stored embedding under EMBED_KEY reaches the encoder; the result has
+    # None where the stored embedding is reused at insert time
+    start = time.perf_counter()
+    hashes = [content_hash(t) for t in texts]
+    known = get_known_hashes(hashes, EMBED_KEY)
+    unseen = {}
+    for h, t in zip(hashes, texts):
+        if h not in known and h not in unseen:
+            unseen[h] = t
+    reused = len(texts) - len(unseen)
+    if log:
+        log(reused, len(texts))
+    encoded, _ = encode_texts(model, list(unseen.values()), batch_size,
+                              (lambda done, _: log(reused + done, len(texts))) if log else None)
+    by_hash = dict(zip(unseen, encoded))
+    embeddings = [by_hash.get(h) for h in hashes]
+    return embeddings, embed_stats(len(texts), time.perf_counter() - start, encoded=len(unseen))
+
+def embed_chunks(model, chunks, batch_size=EMBED_BATCH_SIZE, log=None):
+    # backfill rows that already exist: reuse stored embeddings, then encode a batch and
+    # write it back in one UPDATE
+    start = time.perf_counter()
+    reused = reuse_embeddings([c["id"] for c in chunks], EMBED_KEY)
+    todo = [c for c in chunks if c["id"] not in reused]
+    done = len(reused)
+    for i in range(0, len(todo), batch_size):
+        batch = todo[i:i + batch_size]
+        embeddings = model.encode([c["content"] for c in batch], batch_size=batch_size,
+                                  normalize_embeddings=True)
+        save_embeddings([(c["id"], emb) for c, emb in zip(batch, embeddings)], EMBED_KEY)
+        done += len(batch)
+        if log:
+            log(done, len(chunks))
+    return embed_stats(done, time.perf_counter() - start, encoded=len(todo))
+
+def embed_label(model, label_id, batch_size=EMBED_BATCH_SIZE):
+    # only this label's missing embeddings; bounded by the label size, never by the backlog
+    report = embed_chunks(model, get_chunks_without_embeddings(label_id=label_id), batch_size)
+    if report["chunks"]:
+        invalidate_label(label_id)
+    return report
+
+def drain_embeddings(model, batch_size=EMBED_BATCH_SIZE, max_chunks=None, log=None):
+    # global backlog, paged through the partial index; for bulk_load / manage.py only
+    start = time.perf_counter()
+    done = encoded = 0
+    after = (0, 0)
+    while max_chunks is None or done < max_chunks:
+        limit = batch_size if max_chunks is None else min(batch_size, max_chunks - done)
+        chunks = get_chunks_without_embeddings(after=after, limit=limit)
+        if not chunks:
+            break
+        report = embed_chunks(model, chunks, batch_size)
+        done += report["chunks"]
+        encoded += report["encoded"]
+        after = (chunks[-1]["label_id"], chunks[-1]["id"])
+        if log:
+            log(done)
+    return embed_stats(done, time.perf_counter() - start, encoded=encoded)
+
+def embed_stats(count, seconds, encoded=None):
+    encoded = count if encoded is None else encoded
+    return {
+        "chunks": count,
+        "encoded": encoded,
+        "reused": count - encoded,
+        "hit_rate": round((count - encoded) / count, 3) if count else 0.0,
+        "seconds": round(seconds, 3),
+        "chunks_per_sec": round(count / seconds, 1) if seconds > 0 else 0.0,
+    }
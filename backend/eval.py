@@ -1,6 +1,8 @@
 import time
+import argparse
 import requests
-from db import engine
+import numpy as np
+from db import engine, normalize_drug_query
 from sqlalchemy import text
 
 BACKEND = "http://127.0.0.1:8000"
@@ -130,19 +132,29 @@ QUERIES = [
 GOOD_DISTANCE_THRESHOLD = 0.65
 MIN_GOOD_CHUNKS = 2
 
-def evaluate():
-    print(f"\nRunning benchmark on {len(QUERIES)} queries...\n")
+def is_good(matches):
+    # only cosine distances are comparable to the threshold; keyword fallback matches carry none
+    good_chunks = [
+        m for m in matches
+        if m.get("distance") is not None and float(m["distance"]) < GOOD_DISTANCE_THRESHOLD
+    ]
+    return len(good_chunks) >= MIN_GOOD_CHUNKS
+
+def evaluate(mode=None, fusion=None):
+    print(f"\nRunning benchmark on {len(QUERIES)} queries{f' ({mode} search)' if mode else ''}...\n")
 
     results = []
     latencies = []
     fallback_count = 0
+    run_start = time.perf_counter()
 
     for i, (drug, query) in enumerate(QUERIES):
         start = time.perf_counter()
         try:
             resp = requests.get(
                 f"{BACKEND}/rag/search",
-                params={"q": query, "k": 5},
+                params={"q": query, "k": 5, **({"mode": mode} if mode else {}),
+                        **({"fusion": fusion} if fusion else {})},
                 timeout=30
             )
             elapsed_ms = (time.perf_counter() - start) * 1000
@@ -159,11 +171,7 @@ def evaluate():
             if used_fallback:
                 fallback_count += 1
 
-            good_chunks = [
-                m for m in matches
-                if m.get("distance") is not None and float(m["distance"]) < GOOD_DISTANCE_THRESHOLD
-            ]
-            success = len(good_chunks) >= MIN_GOOD_CHUNKS
+            success = is_good(matches)
             results.append(success)
 
             status = "OK  " if success else "MISS"
@@ -177,6 +185,7 @@ def evaluate():
             print(f"  [{i+1:03d}] ERROR — {e}")
 
     # ── RESULTS ──
+    wall = time.perf_counter() - run_start
     total = len(results)
     passed = sum(results)
     coverage = (passed / total) * 100
@@ -198,6 +207,7 @@ Fallback triggered: {fallback_count} times ({(fallback_count/total)*100:.1f}%)
 Latency
   Average         : {avg_latency:.1f}ms
   p95             : {p95_latency:.1f}ms
+  Throughput      : {total / wall:.1f} queries/s ({wall:.2f}s total)
 {'='*55}
 
   Coverage        : {coverage:.0f}%
@@ -208,5 +218,113 @@ Latency
 {'='*55}
     """)
 
+    # counters are cumulative for the backend process; run the eval again to see warm-cache
+    # latency, and the hit rate should climb as repeated queries skip the encoder
+    try:
+        stats = requests.get(f"{BACKEND}/cache/stats", timeout=5).json()["query_embeddings"]
+        print(f"Query embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%}), {stats['size']}/{stats['maxsize']} entries")
+    except Exception as e:
+        print(f"Query embedding cache: stats unavailable ({e})")
+
+def evaluate_batch(batch_size=100):
+    # same queries and scoring, sent through /rag/search_batch; compare throughput with evaluate()
+    print(f"\nRunning batch benchmark on {len(QUERIES)} queries, {batch_size} per request...\n")
+
+    results = []
+    request_ms = []
+    run_start = time.perf_counter()
+    for b in range(0, len(QUERIES), batch_size):
+        chunk = QUERIES[b:b + batch_size]
+        start = time.perf_counter()
+        resp = requests.post(f"{BACKEND}/rag/search_batch",
+                             json={"queries": [{"q": query, "k": 5} for _, query in chunk]}, timeout=120)
+        request_ms.append((time.perf_counter() - start) * 1000)
+        data = resp.json() if resp.status_code == 200 else {"error": f"http {resp.status_code}"}
+        if "error" in data:
+            print(f"  batch {b // batch_size + 1} FAIL — {data['error']}")
+            results.extend([False] * len(chunk))
+            continue
+        for i, ((drug, query), result) in enumerate(zip(chunk, data["results"])):
+            success = is_good(result["matches"])
+            results.append(success)
+            print(f"  [{b + i + 1:03d}] {'OK  ' if success else 'MISS'} — {drug}: {query[:55]}")
+
+    wall = time.perf_counter() - run_start
+    total = len(results)
+    passed = sum(results)
+    print(f"""
+{'='*55}
+BATCH BENCHMARK RESULTS
+{'='*55}
+Total queries     : {total}
+Passed            : {passed}
+Coverage          : {(passed / total) * 100:.1f}%
+Requests          : {len(request_ms)} (avg {sum(request_ms) / len(request_ms):.1f}ms each)
+Throughput        : {total / wall:.1f} queries/s ({wall:.2f}s total)
+{'='*55}
+    """)
+
+def encoder_pool():
+    # chunks of the labels stored for the benchmark drugs, the corpus every backend re-encodes
+    drugs = sorted({normalize_drug_query(drug) for drug, _ in QUERIES})
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT DISTINCT c.id, c.content FROM label_chunks c
+            JOIN label_queries q ON q.label_id = c.label_id
+            WHERE q.drug_query = ANY(CAST(:drugs AS text[]))
+            ORDER BY c.id;
+        """), {"drugs": drugs}).mappings().all()
+    return [dict(r) for r in rows]
+
+def evaluate_encoders(backends, k=5):
+    # encoder parity without a server: each backend encodes both the benchmark labels' chunks and
+    # the queries, and ranks within its own vectors, so int8 is measured end to end instead of
+    # against the stored fp32 embeddings; the first backend is the reference
+    from embed import load_encoder, EMBED_BATCH_SIZE
+    pool = encoder_pool()
+    if not pool:
+        print("No stored labels for the benchmark drugs; run bulk_load.py first")
+        return
+    print(f"\nEncoder parity on {len(QUERIES)} queries over {len(pool)} chunks, top {k} "
+          f"(reference: {backends[0]})\n")
+
+    runs = {}
+    for backend in backends:
+        model = load_encoder(backend)
+        start = time.perf_counter()
+        chunk_vecs = model.encode([c["content"] for c in pool], batch_size=EMBED_BATCH_SIZE,
+                                  normalize_embeddings=True)
+        encode_s = time.perf_counter() - start
+        query_vecs = model.encode([query for _, query in QUERIES], normalize_embeddings=True)
+        distances = 1 - np.asarray(query_vecs) @ np.asarray(chunk_vecs).T
+        top = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        runs[backend] = [[{"id": pool[j]["id"], "distance": float(distances[i, j])} for j in row]
+                         for i, row in enumerate(top)]
+        print(f"  {backend:<10} encoded {len(pool)} chunks in {encode_s:.1f}s")
+    print()
+
+    reference = runs[backends[0]]
+    ref_coverage = sum(is_good(matches) for matches in reference) / len(QUERIES) * 100
+    for backend in backends:
+        coverage = sum(is_good(matches) for matches in runs[backend]) / len(QUERIES) * 100
+        overlap = sum(len({m["id"] for m in a} & {m["id"] for m in b}) / k
+                      for a, b in zip(runs[backend], reference)) / len(QUERIES)
+        verdict = "" if backend == backends[0] else ("  ok" if coverage >= ref_coverage else "  REGRESSED")
+        print(f"  {backend:<10} coverage {coverage:5.1f}%  top-{k} overlap with {backends[0]} {overlap:6.1%}{verdict}")
+
 if __name__ == "__main__":
-    evaluate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Retrieval benchmark against a running backend")
+    parser.add_argument("--mode", choices=["vector", "hybrid"], help="default: the server's SEARCH_MODE")
+    parser.add_argument("--fusion", choices=["rrf", "weighted"], help="hybrid score fusion")
+    parser.add_argument("--batch", type=int, nargs="?", const=100, metavar="SIZE",
+                        help="send the queries through /rag/search_batch, SIZE per request (vector search only)")
+    parser.add_argument("--encoders", metavar="A,B",
+                        help="compare encoder backends locally (e.g. torch,onnx-int8) instead of querying the server")
+    args = parser.parse_args()
+    if args.encoders:
+        evaluate_encoders(args.encoders.split(","))
+    elif args.batch:
+        evaluate_batch(args.batch)
+    else:
+        evaluate(args.mode, args.fusion)
\ No newline at end of file
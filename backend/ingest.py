@@ -0,0 +1,93 @@
+import os
+from db import save_label_with_chunks, find_label, get_fresh_label, touch_label_query, label_identity
+from embed import encode_unseen, embed_label, EMBED_KEY
+
+SECTIONS = [
+    "adverse_reactions", "boxed_warning", "contraindications",
+    "dosage_and_administration", "drug_interactions", "precautions",
+    "use_in_specific_populations", "warnings", "warnings_and_cautions"
+]
+
+CHUNK_SIZE = 900
+CHUNK_OVERLAP = 120
+
+# how long a drug query -> label mapping is trusted before openFDA is asked again
+LABEL_TTL_SECONDS = int(os.getenv("LABEL_TTL_SECONDS", str(24 * 3600)))
+
+def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + size
+        chunks.append(text[start:end])
+        start += size - overlap
+    return chunks
+
+def parse_label(r):
+    openfda = r.get("openfda", {})
+    sections = {}
+    for s in SECTIONS:
+        val = r.get(s)
+        if val:
+            sections[s] = val[0] if isinstance(val, list) else val
+    return {
+        "brand_name": openfda.get("brand_name", [""])[0],
+        "generic_name": openfda.get("generic_name", [""])[0],
+        "manufacturer": openfda.get("manufacturer_name", [""])[0],
+        "effective_time": r.get("effective_time", ""),
+        "sections": sections,
+    }
+
+def build_chunks(sections):
+    all_chunks = []
+    for section, content in sections.items():
+        for i, chunk in enumerate(chunk_text(content)):
+            all_chunks.append((section, i, chunk))
+    return all_chunks
+
+def cached_label(model, drug_name, ttl_seconds=LABEL_TTL_SECONDS):
+    fresh = get_fresh_label(drug_name, ttl_seconds)
+    if not fresh:
+        return None
+    if fresh["needs_embedding"]:
+        # e.g. chunks left behind by an interrupted bulk load
+        embed_label(model, fresh["label_id"])
+    return {
+        "label_id": fresh["label_id"],
+        "drug": drug_name,
+        "brand_name": fresh["brand_name"],
+        "generic_name": fresh["generic_name"],
+        "sections_found": fresh["sections_found"],
+        "cached": True,
+    }
+
+def store_label(model, drug_name, r, progress=None):
+    label = parse_label(r)
+    summary = {
+        "drug": drug_name,
+        "brand_name": label["brand_name"],
+        "generic_name": label["generic_name"],
+        "sections_found": list(label["sections"].keys()),
+    }
+
+    # same openFDA label version already stored: no chunking, no embedding
+    existing = find_label(label_identity(r), label["effective_time"])
+    if existing:
+        touch_label_query(drug_name, existing)
+        embed_label(model, existing)
+        return {"label_id": existing, **summary, "cached": True}
+
+    # chunk
+    all_chunks = build_chunks(label["sections"])
+    if progress:
+        progress("chunked", 0, len(all_chunks))
+
+    # embed text not seen before; the rest comes from the embedding store
+    log = (lambda done, total: progress("embedding", done, total)) if progress else None
+    embeddings, embed_report = encode_unseen(model, [content for _, _, content in all_chunks], log=log)
+
+    # store label, chunks and embeddings in one transaction
+    label_id, _ = save_label_with_chunks(drug_name, label["brand_name"], label["generic_name"],
+                                         label["manufacturer"], label["effective_time"],
+                                         label["sections"], r, all_chunks, embeddings, EMBED_KEY)
+    return {"label_id": label_id, **summary, "cached": False, "embedding": embed_report}
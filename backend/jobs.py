@@ -0,0 +1,123 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from db import create_job, claim_job, get_job, update_job, renew_job_leases, requeue_unfinished_jobs
+from ingest import cached_label, store_label
+from openfda import fetch_label
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# how long /assist/answer waits on an in-flight ingest for its drug
+INGEST_WAIT_SECONDS = float(os.getenv("INGEST_WAIT_SECONDS", "60"))
+# a running job whose process has not renewed it for this long is requeued for another process
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "120"))
+FINISHED = ("done", "failed")
+
+_executor = None
+_model = None
+_events = {}
+_running = set()
+_events_lock = threading.Lock()
+_stop = threading.Event()
+# this process, as recorded on the jobs it claims
+_worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def start_workers(model, workers=INGEST_WORKERS):
+    # one pool per process; queued jobs, and running jobs whose process stopped renewing its lease,
+    # are picked up again (claiming is atomic, so several processes may schedule the same job)
+    global _executor, _model
+    _model = model
+    _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+    _stop.clear()
+    threading.Thread(target=_heartbeat, name="ingest-lease", daemon=True).start()
+    for job_id in requeue_unfinished_jobs(INGEST_LEASE_SECONDS):
+        _schedule(job_id)
+
+def stop_workers():
+    _stop.set()
+    if _executor:
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+def _heartbeat():
+    # renews the leases of this process's running jobs and picks up jobs abandoned by others
+    while not _stop.wait(INGEST_LEASE_SECONDS / 3):
+        try:
+            with _events_lock:
+                running = list(_running)
+            if running:
+                renew_job_leases(running, _worker)
+            for job_id in requeue_unfinished_jobs(INGEST_LEASE_SECONDS):
+                with _events_lock:
+                    scheduled = job_id in _events
+                if not scheduled:
+                    _schedule(job_id)
+        except Exception:
+            pass  # database unavailable; retried on the next beat
+
+def submit(drug_name):
+    job, created = create_job(drug_name)
+    if created:
+        _schedule(job["id"])
+    return job
+
+def wait_for_job(job_id, timeout):
+    # blocks until the job finishes or `timeout` seconds pass; returns the latest job row
+    deadline = time.monotonic() + timeout
+    while True:
+        job = get_job(job_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job["status"] in FINISHED or remaining <= 0:
+            return job
+        with _events_lock:
+            event = _events.get(job_id)
+        if event:
+            event.wait(min(remaining, 1.0))
+        else:
+            time.sleep(min(remaining, 0.25))  # running in another process
+
+def resolve_label(drug_name, timeout=INGEST_WAIT_SECONDS):
+    # returns (label_id, job); joins the in-flight job for this drug instead of starting another
+    cached = cached_label(_model, drug_name)
+    if cached:
+        return cached["label_id"], None
+    job = wait_for_job(submit(drug_name)["id"], timeout)
+    return (job["label_id"] if job["status"] == "done" else None), job
+
+def _schedule(job_id):
+    with _events_lock:
+        _events[job_id] = threading.Event()
+    _executor.submit(_run, job_id)
+
+def _run(job_id):
+    try:
+        job = claim_job(job_id, _worker)
+        if job is None:
+            return  # already picked up by another worker or process
+        with _events_lock:
+            _running.add(job_id)
+        drug_name = job["drug_query"]
+
+        summary = cached_label(_model, drug_name)
+        if summary is None:
+            r, error = asyncio.run(fetch_label(drug_name))
+            if error:
+                update_job(job_id, _worker, status="failed", stage="failed", error=error)
+                return
+            update_job(job_id, _worker, stage="fetched")
+
+            def progress(stage, done, total):
+                update_job(job_id, _worker, stage=stage, embedded=done, total=total)
+
+            summary = store_label(_model, drug_name, r, progress=progress)
+        update_job(job_id, _worker, status="done", stage="done", label_id=summary["label_id"])
+    except Exception as e:
+        update_job(job_id, _worker, status="failed", stage="failed", error=str(e))
+    finally:
+        with _events_lock:
+            _running.discard(job_id)
+            event = _events.pop(job_id, None)
+        if event:
+            event.set()
@@ -1,192 +1,523 @@
 import os
 import json
-import httpx
+import time
+import asyncio
+from typing import Optional
 from fastapi import FastAPI
+from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from sqlalchemy import text
-from sentence_transformers import SentenceTransformer
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from db import init_db, save_label, save_chunks, save_embedding, get_chunks_without_embeddings, get_recent_labels, engine
+from db import init_db, get_recent_labels, engine, async_engine, to_vector, set_search_params
+from embed import EMBED_KEY, load_encoder, aencode_query, aencode_queries, query_cache, QUERY_CACHE_PATH
+from cache import save_embedding_cache, load_embedding_cache
+from rewrite import rewrite_query, cached_rewrite, rewrite_stats, normalize_question
+from answers import answer_question, stream_answer, similar_answer, build_citations, answer_stats
+from ingest import cached_label, store_label
+from openfda import fetch_label
+from bm25 import bm25_search, bm25_cache, label_index
+from vector_cache import label_vectors, label_vector_search, warm_label
+from rerank import RERANK, RERANK_CANDIDATES, load_reranker, rerank_matches, rerank_stats
+from jobs import start_workers, stop_workers, submit, resolve_label, get_job, FINISHED
 
 load_dotenv()
 
 app = FastAPI()
 model = None
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=os.getenv("GOOGLE_API_KEY"))
-
-SECTIONS = [
-    "adverse_reactions", "boxed_warning", "contraindications",
-    "dosage_and_administration", "drug_interactions", "precautions",
-    "use_in_specific_populations", "warnings", "warnings_and_cautions"
-]
-
-CHUNK_SIZE = 900
-CHUNK_OVERLAP = 120
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
+llm = ChatGoogleGenerativeAI(model=LLM_MODEL, google_api_key=os.getenv("GOOGLE_API_KEY"))
+
+# keyword fallback rank is ts_rank_cd normalized to [0, 1); not a cosine distance, so it has none
+KEYWORD_MIN_RANK = float(os.getenv("KEYWORD_MIN_RANK", "0"))
+# label-scoped keyword fallback: tsvector (Postgres query) | bm25 (in-process index per label)
+KEYWORD_INDEX = os.getenv("KEYWORD_INDEX", "tsvector")
+# most queries accepted by one /rag/search_batch call
+SEARCH_BATCH_MAX = int(os.getenv("SEARCH_BATCH_MAX", "256"))
+
+# speculative retrieval: search the raw question while the rewrite runs; past the budget the
+# answer goes ahead on the raw-question evidence (the rewrite still finishes into its cache)
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "0") == "1"
+REWRITE_BUDGET_MS = float(os.getenv("REWRITE_BUDGET_MS", "1500"))
+# reciprocal rank fusion constant: score = sum of 1 / (RRF_K + rank) over the fused lists
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# /rag/search: vector (ANN, keyword query only when the hits are weak) | hybrid (vector and
+# full-text candidates fused in one statement, by rrf or weighted scores)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")
+# candidates taken from each signal before fusing, and the vector share of a weighted score
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "0.7"))
 
 @app.on_event("startup")
 def startup():
     
     global model
     init_db()
-    model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
-
-def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + size
-        chunks.append(text[start:end])
-        start += size - overlap
-    return chunks
+    model = load_encoder()
+    load_embedding_cache(query_cache, QUERY_CACHE_PATH, EMBED_KEY)
+    if RERANK:
+        load_reranker()
+    start_workers(model)
+
+@app.on_event("shutdown")
+async def shutdown():
+    stop_workers()
+    await async_engine.dispose()
+    if QUERY_CACHE_PATH:
+        save_embedding_cache(query_cache, QUERY_CACHE_PATH, EMBED_KEY)
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/cache/stats")
+def cache_stats():
+    return {"query_embeddings": query_cache.stats(), "rewrites": rewrite_stats(),
+            "answers": answer_stats(), "bm25": bm25_cache.stats(), "label_vectors": label_vectors.stats(),
+            "rerank_scores": rerank_stats()}
+
 @app.get("/assist/label_summary")
 
 async def label_summary(drug_name: str):
-    url = "https://api.fda.gov/drug/label.json"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, params={"search": f"openfda.generic_name:{drug_name}", "limit": 1})
-        if resp.status_code != 200 or not resp.json().get("results"):
-            resp = await client.get(url, params={"search": f"openfda.brand_name:{drug_name}", "limit": 1})
-        if resp.status_code != 200:
-            return {"error": "Could not fetch label"}
-
-    data = resp.json()
-    results = data.get("results", [])
-    if not results:
-        return {"error": "No label found for this drug"}
-
-    r = results[0]
-    openfda = r.get("openfda", {})
-    brand_name = openfda.get("brand_name", [""])[0]
-    generic_name = openfda.get("generic_name", [""])[0]
-    manufacturer = openfda.get("manufacturer_name", [""])[0]
-    effective_time = r.get("effective_time", "")
-
-    sections = {}
-    for s in SECTIONS:
-        val = r.get(s)
-        if val:
-            sections[s] = val[0] if isinstance(val, list) else val
-
-    label_id = save_label(drug_name, brand_name, generic_name, manufacturer, effective_time, sections, r)
-
-    # chunk
-    all_chunks = []
-    for section, content in sections.items():
-        for i, chunk in enumerate(chunk_text(content)):
-            all_chunks.append((section, i, chunk))
-    save_chunks(label_id, all_chunks)
-
-    # embed
-    chunks_to_embed = get_chunks_without_embeddings()
-    for chunk in chunks_to_embed:
-        embedding = model.encode(chunk["content"], normalize_embeddings=True)
-        save_embedding(chunk["id"], embedding)
-
-    return {
-        "label_id": label_id,
-        "drug": drug_name,
-        "brand_name": brand_name,
-        "generic_name": generic_name,
-        "sections_found": list(sections.keys()),
-    }
+    # known label version checked within LABEL_TTL_SECONDS: no network, chunking or embedding
+    cached = await asyncio.to_thread(cached_label, model, drug_name)
+    if cached:
+        summary = cached
+    else:
+        r, error = await fetch_label(drug_name)
+        if error:
+            return {"error": error}
+
+        # chunking/embedding/storing is blocking work; keep it off the event loop
+        summary = await asyncio.to_thread(store_label, model, drug_name, r)
+
+    # the UI asks about this label next; build its keyword index and load its vectors now
+    if KEYWORD_INDEX == "bm25":
+        await label_index(summary["label_id"])
+    warm_label(summary["label_id"])
+    return summary
+
+def job_response(job):
+    job = dict(job)
+    job["created_at"] = str(job["created_at"])
+    job["updated_at"] = str(job["updated_at"])
+    return job
+
+@app.post("/ingest/jobs")
+def submit_ingest(drug_name: str):
+    return job_response(submit(drug_name))
+
+@app.get("/ingest/jobs/{job_id}")
+def ingest_job(job_id: int):
+    job = get_job(job_id)
+    if not job:
+        return {"error": "Not found"}
+    return job_response(job)
+
+@app.get("/ingest/jobs/{job_id}/events")
+def ingest_job_events(job_id: int):
+    # server-sent events: one message per progress change, closed once the job finishes
+    def events():
+        last = None
+        while True:
+            job = get_job(job_id)
+            if not job:
+                yield f"data: {json.dumps({'error': 'Not found'})}\n\n"
+                return
+            state = (job["status"], job["stage"], job["embedded"])
+            if state != last:
+                last = state
+                yield f"data: {json.dumps(job_response(job))}\n\n"
+            if job["status"] in FINISHED:
+                return
+            time.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+async def keyword_search(q, params, label_filter):
+    async with async_engine.connect() as conn:
+        return (await conn.execute(text(f"""
+            SELECT id, label_id, section, chunk_index, content,
+                   ts_rank_cd(content_tsv, query, 32) AS rank
+            FROM label_chunks, plainto_tsquery('english', :q) AS query
+            WHERE content_tsv @@ query {label_filter}
+              AND ts_rank_cd(content_tsv, query, 32) >= :min_rank
+            ORDER BY rank DESC
+            LIMIT :k;
+        """), {**params, "q": q, "min_rank": KEYWORD_MIN_RANK})).mappings().all()
+
+HYBRID_SCORES = {
+    "rrf": "COALESCE(1.0::float8 / (:rrf_k + vector_rank), 0) + COALESCE(1.0::float8 / (:rrf_k + keyword_rank), 0)",
+    "weighted": ":vector_weight * (1 - COALESCE(vector_distance, 1)) + (1 - :vector_weight) * COALESCE(keyword_score, 0)",
+}
+
+async def hybrid_search(q, params, label_id, ef_search, probes, fusion):
+    # one round trip: top vector and top full-text candidates as CTEs, both signals scored for
+    # every candidate, fused and ranked in the same statement
+    if label_id:
+        # label-scoped: exact ranking over that label's rows, never the ANN index
+        source = """scoped AS MATERIALIZED (
+                    SELECT id, embedding FROM label_chunks
+                    WHERE label_id = :label_id AND embedding IS NOT NULL
+                ),"""
+        vector_from, keyword_filter = "scoped", "AND label_id = :label_id"
+    else:
+        source, vector_from, keyword_filter = "", "label_chunks WHERE embedding IS NOT NULL", ""
+    candidates = max(HYBRID_CANDIDATES, params["k"])
+    async with async_engine.begin() as conn:
+        if not label_id:
+            await set_search_params(conn, ef_search, probes, limit=candidates)
+        rows = (await conn.execute(text(f"""
+            WITH {source}
+            vec AS (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+                FROM (SELECT id, embedding <=> :emb AS distance FROM {vector_from}
+                      ORDER BY distance LIMIT :candidates) v
+            ),
+            kw AS (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC) AS rank
+                FROM (SELECT id, ts_rank_cd(content_tsv, query, 32) AS score
+                      FROM label_chunks, plainto_tsquery('english', :q) AS query
+                      WHERE content_tsv @@ query {keyword_filter}
+                      ORDER BY score DESC LIMIT :candidates) k
+            ),
+            candidates AS (
+                SELECT c.id, c.label_id, c.section, c.chunk_index, c.content,
+                       c.embedding <=> :emb AS vector_distance, vec.rank AS vector_rank,
+                       ts_rank_cd(c.content_tsv, plainto_tsquery('english', :q), 32)::float8 AS keyword_score,
+                       kw.rank AS keyword_rank
+                FROM vec FULL OUTER JOIN kw ON kw.id = vec.id
+                JOIN label_chunks c ON c.id = COALESCE(vec.id, kw.id)
+            )
+            SELECT id, label_id, section, chunk_index, content,
+                   COALESCE(vector_distance, 1) AS distance, vector_distance, vector_rank,
+                   keyword_score, keyword_rank, {HYBRID_SCORES[fusion]} AS score
+            FROM candidates
+            ORDER BY score DESC, id
+            LIMIT :k;
+        """), {**params, "q": q, "candidates": candidates, "rrf_k": RRF_K,
+               "vector_weight": HYBRID_VECTOR_WEIGHT})).mappings().all()
+    return {"matches": [dict(r) for r in rows], "used_fallback": False, "mode": "hybrid", "fusion": fusion}
 
 @app.get("/rag/search")
-def rag_search(q: str, k: int = 5, label_id: int = None):
-    query_embedding = model.encode(q, normalize_embeddings=True)
-    emb_str = "[" + ",".join([str(float(x)) for x in query_embedding]) + "]"
+async def rag_search(q: str, k: int = 5, label_id: int = None, ef_search: int = None, probes: int = None,
+                     mode: str = None, fusion: str = None, rerank: bool = None):
+    if not (RERANK if rerank is None else rerank):
+        return await retrieve(q, k, label_id, ef_search, probes, mode, fusion)
+
+    # over-fetch, then keep the k the cross-encoder scores best
+    search = await retrieve(q, k, label_id, ef_search, probes, mode, fusion,
+                            fetch_k=max(k, RERANK_CANDIDATES))
+    if "error" in search:
+        return search
+    matches, report = await rerank_matches(q, search["matches"], k)
+    return {**search, "matches": matches, "rerank": report}
+
+async def retrieve(q, k, label_id, ef_search, probes, mode, fusion, fetch_k=None):
+    # returns up to fetch_k matches (default k); the weak-result fallback is judged on the top k
+    fetch_k = max(fetch_k or k, k)
+    mode = mode or SEARCH_MODE
+    fusion = fusion or HYBRID_FUSION
+    if mode not in ("vector", "hybrid"):
+        return {"error": "mode must be vector or hybrid"}
+    if fusion not in HYBRID_SCORES:
+        return {"error": "fusion must be rrf or weighted"}
+
+    query_embedding = await aencode_query(model, q)
 
     label_filter = "AND label_id = :label_id" if label_id else ""
-    params = {"emb": emb_str, "k": k}
+    params = {"emb": to_vector(query_embedding), "k": fetch_k}
     if label_id:
         params["label_id"] = label_id
-
-    with engine.connect() as conn:
-        rows = conn.execute(text(f"""
-            SELECT id, label_id, section, chunk_index, content,
-                   embedding <=> CAST(:emb AS vector) AS distance
-            FROM label_chunks
-            WHERE embedding IS NOT NULL {label_filter}
-            ORDER BY distance ASC
-            LIMIT :k;
-        """), params).mappings().all()
+    if mode == "hybrid":
+        return await hybrid_search(q, params, label_id, ef_search, probes, fusion)
+
+    # label-scoped on a hot label: ranked in process from its cached embedding matrix
+    rows = label_vector_search(label_id, query_embedding, fetch_k) if label_id else None
+    if rows is None:
+        async with async_engine.begin() as conn:
+            if label_id:
+                # label-scoped: exact ranking over that label's rows, never the ANN index
+                rows = (await conn.execute(text("""
+                    WITH scoped AS MATERIALIZED (
+                        SELECT id, label_id, section, chunk_index, content, embedding
+                        FROM label_chunks
+                        WHERE label_id = :label_id AND embedding IS NOT NULL
+                    )
+                    SELECT id, label_id, section, chunk_index, content,
+                           embedding <=> :emb AS distance
+                    FROM scoped
+                    ORDER BY distance ASC
+                    LIMIT :k;
+                """), params)).mappings().all()
+            else:
+                await set_search_params(conn, ef_search, probes, limit=fetch_k)
+                rows = (await conn.execute(text("""
+                    SELECT id, label_id, section, chunk_index, content,
+                           embedding <=> :emb AS distance
+                    FROM label_chunks
+                    WHERE embedding IS NOT NULL
+                    ORDER BY distance ASC
+                    LIMIT :k;
+                """), params)).mappings().all()
 
     matches = [dict(r) for r in rows]
 
+    top = matches[:k]
     used_fallback = False
-    if not matches or (sum(m["distance"] for m in matches) / len(matches)) > 0.45:
+    if not top or (sum(m["distance"] for m in top) / len(top)) > 0.45:
         used_fallback = True
-        with engine.connect() as conn:
-            fb_rows = conn.execute(text(f"""
-                SELECT id, label_id, section, chunk_index, content, 0.60 AS distance
-                FROM label_chunks
-                WHERE to_tsvector('english', content) @@ plainto_tsquery('english', :q)
-                {label_filter}
-                LIMIT :k;
-            """), {**params, "q": q}).mappings().all()
+        if label_id and KEYWORD_INDEX == "bm25":
+            fb_rows = await bm25_search(label_id, q, fetch_k)
+        else:
+            fb_rows = await keyword_search(q, params, label_filter)
         if fb_rows:
             matches = [dict(r) for r in fb_rows]
 
-    return {"matches": matches, "used_fallback": used_fallback}
-
+    return {"matches": matches, "used_fallback": used_fallback, "mode": "vector"}
+
+class SearchQuery(BaseModel):
+    q: str
+    label_id: Optional[int] = None
+    k: int = 5
+
+class SearchBatch(BaseModel):
+    queries: list[SearchQuery]
+    ef_search: Optional[int] = None
+    probes: Optional[int] = None
+
+# one statement for the whole batch: a LATERAL top-k per unnested query vector. Label-scoped
+# queries order by "distance + 0", which the ANN index can't serve, so they rank every row of
+# their label exactly (like the scoped CTE in rag_search) instead of filtering ANN candidates
+SEARCH_BATCH_SQL = text("""
+    WITH queries AS (
+        SELECT * FROM unnest(CAST(:embs AS vector[]), CAST(:label_ids AS int[]), CAST(:ks AS int[]))
+                      WITH ORDINALITY AS q(emb, label_id, k, idx)
+    )
+    SELECT q.idx, m.* FROM queries q
+    CROSS JOIN LATERAL (
+        SELECT id, label_id, section, chunk_index, content, embedding <=> q.emb AS distance
+        FROM label_chunks
+        WHERE label_id = q.label_id AND embedding IS NOT NULL
+        ORDER BY (embedding <=> q.emb) + 0
+        LIMIT q.k
+    ) m
+    WHERE q.label_id IS NOT NULL
+    UNION ALL
+    SELECT q.idx, m.* FROM queries q
+    CROSS JOIN LATERAL (
+        SELECT id, label_id, section, chunk_index, content, embedding <=> q.emb AS distance
+        FROM label_chunks
+        WHERE embedding IS NOT NULL
+        ORDER BY embedding <=> q.emb
+        LIMIT q.k
+    ) m
+    WHERE q.label_id IS NULL
+    ORDER BY idx, distance;
+""")
+
+@app.post("/rag/search_batch")
+async def rag_search_batch(batch: SearchBatch):
+    # vector retrieval for many queries: one encode call, one round trip; results in input
+    # order (no keyword fallback, hybrid mode or rerank; use /rag/search for those)
+    if len(batch.queries) > SEARCH_BATCH_MAX:
+        return {"error": f"At most {SEARCH_BATCH_MAX} queries per batch"}
+    if not batch.queries:
+        return {"results": []}
+
+    embeddings = await aencode_queries(model, [item.q for item in batch.queries])
+    async with async_engine.begin() as conn:
+        # unscoped queries go through the ANN index; its candidate list must cover the largest k
+        unscoped_k = max((item.k for item in batch.queries if item.label_id is None), default=None)
+        await set_search_params(conn, batch.ef_search, batch.probes, limit=unscoped_k)
+        rows = (await conn.execute(SEARCH_BATCH_SQL, {
+            "embs": [to_vector(emb) for emb in embeddings],
+            "label_ids": [item.label_id for item in batch.queries],
+            "ks": [item.k for item in batch.queries],
+        })).mappings().all()
+
+    results = [{"matches": [], "used_fallback": False} for _ in batch.queries]
+    for r in rows:
+        match = dict(r)
+        results[match.pop("idx") - 1]["matches"].append(match)
+    return {"results": results}
+
+
+NO_MATCHES_ANSWER = "No relevant information found in the saved labels."
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+async def timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, elapsed_ms(start)
+
+def fuse_searches(searches, k):
+    # reciprocal rank fusion by chunk id; the first list's copy of a chunk is the one kept
+    scores, chunks = {}, {}
+    for search in searches:
+        for rank, m in enumerate(search["matches"], start=1):
+            scores[m["id"]] = scores.get(m["id"], 0.0) + 1 / (RRF_K + rank)
+            chunks.setdefault(m["id"], m)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return {"matches": [{**chunks[i], "rrf_score": round(scores[i], 5)} for i in ranked],
+            "used_fallback": any(search["used_fallback"] for search in searches)}
+
+async def gather_evidence(q, k, label_id, speculative):
+    # rewrite, semantic answer-cache lookup and retrieval; returns a dict with the rewritten
+    # query, the embedding to cache the answer under, a cached paraphrase answer or the search
+    # results, and per-stage timings
+    start = time.perf_counter()
+    timings = {"speculative": speculative}
+    # a rewrite already in memory leaves nothing to overlap: skip the raw search and the fusion
+    rewritten_q = cached_rewrite(LLM_MODEL, q) if speculative else None
+    if rewritten_q is not None:
+        timings["speculative"], timings["rewrite_ms"] = False, 0.0
+    if not timings["speculative"]:
+        if rewritten_q is None:
+            rewritten_q, timings["rewrite_ms"] = await timed(rewrite_query(llm, LLM_MODEL, q))
+        query_embedding = await aencode_query(model, rewritten_q)
+        similar = await similar_answer(LLM_MODEL, label_id, query_embedding)
+        search = None
+        if not similar:
+            search, timings["retrieval_ms"] = await timed(rag_search(rewritten_q, k, label_id=label_id))
+        timings["evidence_ms"] = elapsed_ms(start)
+        return {"rewritten_q": rewritten_q, "query_embedding": query_embedding, "similar": similar,
+                "search": search, "timings": timings}
+
+    raw_task = asyncio.create_task(timed(rag_search(q, k, label_id=label_id)))
+    rewrite_task = asyncio.create_task(timed(rewrite_query(llm, LLM_MODEL, q)))
+    try:
+        rewritten_q, timings["rewrite_ms"] = await asyncio.wait_for(asyncio.shield(rewrite_task),
+                                                                    REWRITE_BUDGET_MS / 1000)
+    except asyncio.TimeoutError:
+        # left running so the rewrite lands in the cache for the next request
+        rewrite_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        rewritten_q = None
+
+    if rewritten_q is None:
+        search, timings["raw_retrieval_ms"] = await raw_task
+        timings["rewrite_timed_out"] = True
+        timings["evidence_ms"] = elapsed_ms(start)
+        # the sequential path would have waited at least the budget, then searched
+        timings["saved_ms"] = round(REWRITE_BUDGET_MS + timings["raw_retrieval_ms"] - timings["evidence_ms"], 1)
+        # no embedding: the semantic cache only holds rewritten-question embeddings
+        return {"rewritten_q": q, "query_embedding": None, "similar": None, "search": search,
+                "timings": timings}
+
+    query_embedding = await aencode_query(model, rewritten_q)
+    same_query = normalize_question(rewritten_q) == normalize_question(q)
+    rewritten_task = None if same_query else asyncio.create_task(timed(rag_search(rewritten_q, k, label_id=label_id)))
+    similar = await similar_answer(LLM_MODEL, label_id, query_embedding)
+    if similar:
+        raw_task.cancel()
+        if rewritten_task:
+            rewritten_task.cancel()
+        search = None
+    else:
+        raw_search, timings["raw_retrieval_ms"] = await raw_task
+        if rewritten_task:
+            rewritten_search, timings["retrieval_ms"] = await rewritten_task
+            search = fuse_searches([rewritten_search, raw_search], k)
+        else:
+            search, timings["retrieval_ms"] = raw_search, timings["raw_retrieval_ms"]
+    timings["evidence_ms"] = elapsed_ms(start)
+    if not similar:
+        timings["saved_ms"] = round(timings["rewrite_ms"] + timings["retrieval_ms"] - timings["evidence_ms"], 1)
+    return {"rewritten_q": rewritten_q, "query_embedding": query_embedding, "similar": similar,
+            "search": search, "timings": timings}
+
+async def answer_label(label_id, drug_name):
+    # returns (label_id, error response); with only a drug name, uses a fresh stored label or
+    # waits on the (possibly already running) ingest job
+    if label_id is None and drug_name:
+        label_id, job = await asyncio.to_thread(resolve_label, drug_name)
+        if label_id is None:
+            if job["status"] == "failed":
+                return None, {"error": job["error"], "job_id": job["id"]}
+            return None, {"error": "Label is still being ingested", "job_id": job["id"]}
+    return label_id, None
 
 @app.get("/assist/answer")
-def assist_answer(q: str, k: int = 5, label_id: int = None):
-    # rewrite query to match FDA clinical language
-    rewrite_prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an FDA medical terminology expert. Rewrite the user's question using clinical FDA label language for better document retrieval. Return only the rewritten query, nothing else."),
-        ("human", "{question}")
-    ])
-    rewrite_chain = rewrite_prompt | llm
-    rewritten_q = rewrite_chain.invoke({"question": q}).content.strip()
-
-    # search using rewritten query
-    search = rag_search(rewritten_q, k, label_id=label_id)
-    matches = search["matches"]
-    used_fallback = search["used_fallback"]
+async def assist_answer(q: str, k: int = 5, label_id: int = None, drug_name: str = None,
+                        speculative: bool = None):
+    start = time.perf_counter()
+    label_id, error = await answer_label(label_id, drug_name)
+    if error:
+        return error
+
+    # rewrite query to match FDA clinical language (cached per normalized question) and search
+    # with it; a paraphrase already answered for this label version skips retrieval and the LLM
+    evidence = await gather_evidence(q, k, label_id, SPECULATIVE_RETRIEVAL if speculative is None else speculative)
+    timings = evidence["timings"]
+    if evidence["similar"]:
+        return {**evidence["similar"], "timings": {**timings, "total_ms": elapsed_ms(start)}}
+
+    matches = evidence["search"]["matches"]
+    used_fallback = evidence["search"]["used_fallback"]
 
     if not matches:
-        return {"answer": "No relevant information found in the saved labels.", "citations": [], "used_fallback": used_fallback}
-
-    evidence_block = ""
-    for i, m in enumerate(matches):
-        evidence_block += f"[{i+1}] Section: {m['section']}\n{m['content']}\n\n"
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are a friendly, helpful medical information assistant explaining FDA drug labels to everyday people with no medical background.
-
-Your job is to answer the user's question in clear, simple English that anyone can understand — no jargon.
-- Explain what the FDA label says in plain words
-- If something is a risk, explain WHY it is a risk in simple terms
-- If the answer is "consult a doctor", explain what specifically to ask the doctor about
-- Use short paragraphs, not bullet points
-- Always cite which chunk number(s) your answer comes from using [1], [2] etc.
-- Use ONLY the evidence provided. Do not use outside knowledge.
-- If the evidence does not contain the answer, say what IS known from the label instead of just saying not found.
-"""),
-        ("human", "Question: {question}\n\nEvidence:\n{evidence}")
-    ])
-
-    chain = prompt | llm
-    response = chain.invoke({"question": q, "evidence": evidence_block})
-    answer = response.content
-
-    citations = []
-    for i, m in enumerate(matches):
-        citations.append({
-            "id": m["id"],
-            "label_id": m["label_id"],
-            "section": m["section"],
-            "chunk_index": m["chunk_index"],
-            "distance": float(m["distance"]),
-        })
-
-    return {"answer": answer, "citations": citations, "used_fallback": used_fallback}
+        return {"answer": NO_MATCHES_ANSWER, "citations": [], "used_fallback": used_fallback,
+                "timings": {**timings, "total_ms": elapsed_ms(start)}}
+
+    # same question, label version and evidence as before: cached answer, no LLM call
+    result = await answer_question(llm, LLM_MODEL, q, label_id, matches, used_fallback,
+                                   evidence["query_embedding"])
+    return {**result, "timings": {**timings, "total_ms": elapsed_ms(start)}}
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/assist/answer/stream")
+async def assist_answer_stream(q: str, k: int = 5, label_id: int = None, drug_name: str = None,
+                               speculative: bool = None):
+    # server-sent events: "evidence" (citations, as soon as retrieval is done), then "token"
+    # events as Gemini produces the answer, then "done" with timings; "error" ends the stream early
+    async def events():
+        start = time.perf_counter()
+        scoped_label_id, error = await answer_label(label_id, drug_name)
+        if error:
+            yield sse("error", error)
+            return
+
+        evidence = await gather_evidence(q, k, scoped_label_id,
+                                         SPECULATIVE_RETRIEVAL if speculative is None else speculative)
+        rewritten_q, timings = evidence["rewritten_q"], evidence["timings"]
+        similar = evidence["similar"]
+        if similar:
+            yield sse("evidence", {"citations": similar["citations"], "used_fallback": similar["used_fallback"],
+                                   "rewritten_query": rewritten_q, "cache_match": similar["cache_match"]})
+            yield sse("token", {"text": similar["answer"]})
+            yield sse("done", {"cached": True, "cache_match": similar["cache_match"], "timings": timings,
+                               "total_ms": elapsed_ms(start)})
+            return
+
+        search = evidence["search"]
+        matches = search["matches"]
+        yield sse("evidence", {"citations": build_citations(matches), "used_fallback": search["used_fallback"],
+                               "rewritten_query": rewritten_q})
+        retrieval_ms = elapsed_ms(start)
+        if not matches:
+            yield sse("token", {"text": NO_MATCHES_ANSWER})
+            yield sse("done", {"cached": False, "cache_match": None, "retrieval_ms": retrieval_ms,
+                               "timings": timings, "total_ms": retrieval_ms})
+            return
+
+        first_token_ms, cached = None, False
+        async for part, cached in stream_answer(llm, LLM_MODEL, q, scoped_label_id, matches,
+                                                search["used_fallback"], evidence["query_embedding"]):
+            if first_token_ms is None:
+                first_token_ms = elapsed_ms(start)
+            yield sse("token", {"text": part})
+        yield sse("done", {"cached": cached, "cache_match": None, "retrieval_ms": retrieval_ms,
+                           "time_to_first_token_ms": first_token_ms, "timings": timings,
+                           "total_ms": elapsed_ms(start)})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.get("/db/recent_labels")
 def recent_labels(limit: int = 10):
     items = get_recent_labels(limit)
@@ -0,0 +1,31 @@
+import argparse
+from db import init_db, build_vector_index, clear_chunk_embeddings, VECTOR_INDEX
+from embed import drain_embeddings, load_encoder, EMBED_BATCH_SIZE
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintenance commands for the FDA assistant database")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("index", help="build the ANN index on label_chunks.embedding")
+    p.add_argument("--kind", choices=["hnsw", "ivfflat"], default=VECTOR_INDEX if VECTOR_INDEX != "none" else "hnsw")
+    p.add_argument("--lists", type=int, help="ivfflat lists (default: embedded rows / 1000, min 10)")
+    p.add_argument("--rebuild", action="store_true", help="drop and recreate the index")
+
+    p = sub.add_parser("drain-embeddings", help="embed chunks left without an embedding, label by label")
+    p.add_argument("--max", type=int, help="stop after this many chunks")
+    p.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    p.add_argument("--reembed", action="store_true",
+                   help="clear every chunk embedding first, e.g. after switching to or from onnx-int8")
+
+    args = parser.parse_args()
+    init_db(build_index=False)
+    if args.command == "index":
+        name = build_vector_index(args.kind, lists=args.lists, rebuild=args.rebuild)
+        print(f"Index {name} ready")
+    elif args.command == "drain-embeddings":
+        model = load_encoder()
+        if args.reembed:
+            print(f"Cleared {clear_chunk_embeddings()} chunk embeddings")
+        report = drain_embeddings(model, args.batch_size, args.max, log=lambda done: print(f"  Embedded {done}"))
+        print(f"Embedded {report['chunks']} chunks in {report['seconds']}s "
+              f"({report['chunks_per_sec']} chunks/sec, {report['reused']} reused)")
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import httpx
+
+OPENFDA_LABEL_URL = "https://api.fda.gov/drug/label.json"
+# openFDA allows 240 requests/minute per key or IP (1,000/day without a key, 120,000/day with one)
+OPENFDA_API_KEY = os.getenv("OPENFDA_API_KEY")
+OPENFDA_RATE_PER_MIN = int(os.getenv("OPENFDA_RATE_PER_MIN", "240"))
+OPENFDA_MAX_RETRIES = 5
+
+# on-disk response cache: readwrite | replay (cache only, never touches the network) | off
+OPENFDA_CACHE_MODE = os.getenv("OPENFDA_CACHE_MODE", "readwrite")
+OPENFDA_CACHE_DIR = os.getenv("OPENFDA_CACHE_DIR", ".openfda_cache")
+OPENFDA_CACHE_TTL_SECONDS = int(os.getenv("OPENFDA_CACHE_TTL_SECONDS", str(24 * 3600)))
+# openFDA answers "no matches" with a 404; caching it saves the generic -> brand fallback round trip
+CACHEABLE_STATUS = (200, 404)
+
+class TokenBucket:
+    # async rate limiter: `rate` requests/second on average, bursts of up to `capacity`
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def openfda_limiter(per_minute=OPENFDA_RATE_PER_MIN):
+    # one per process; shared by every request that goes through the same client
+    return TokenBucket(per_minute / 60, capacity=max(1, per_minute // 60))
+
+def cache_path(params):
+    # keyed by the search itself, never by the API key
+    key = json.dumps({k: v for k, v in params.items() if k != "api_key"}, sort_keys=True)
+    return os.path.join(OPENFDA_CACHE_DIR, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+def read_cache(params):
+    try:
+        with open(cache_path(params)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_cache(params, entry):
+    # write-then-rename so concurrent fetchers never read a half-written file
+    path = cache_path(params)
+    os.makedirs(OPENFDA_CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+def cache_entry(params, resp):
+    return {
+        "params": {k: v for k, v in params.items() if k != "api_key"},
+        "status": resp.status_code,
+        "body": resp.text,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }
+
+def cached_response(entry):
+    return httpx.Response(entry["status"], content=entry["body"].encode(),
+                          headers={"Content-Type": "application/json", "X-Cache": "hit"})
+
+def revalidation_headers(entry):
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+def retry_delay(resp, attempt):
+    # honour Retry-After on 429/503, otherwise exponential backoff with jitter, capped at 30s
+    retry_after = resp.headers.get("Retry-After") if resp is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return min(30, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+async def request_with_retry(client, params, headers, limiter=None, retries=OPENFDA_MAX_RETRIES):
+    # 429, 5xx and connection errors are retried; anything else is returned as is
+    if OPENFDA_API_KEY:
+        params = {**params, "api_key": OPENFDA_API_KEY}
+    for attempt in range(retries + 1):
+        if limiter:
+            await limiter.acquire()
+        try:
+            resp = await client.get(OPENFDA_LABEL_URL, params=params, headers=headers)
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+            resp = None
+        if resp is not None and (resp.status_code != 429 and resp.status_code < 500 or attempt == retries):
+            return resp
+        await asyncio.sleep(retry_delay(resp, attempt))
+
+async def openfda_get(client, params, limiter=None, mode=OPENFDA_CACHE_MODE):
+    # fresh cache hits skip the network (and the rate limiter); stale entries are revalidated
+    # with ETag / Last-Modified and served as a fallback when openFDA can't be reached
+    entry = read_cache(params) if mode != "off" else None
+    if entry and (mode == "replay" or time.time() - entry["fetched_at"] < OPENFDA_CACHE_TTL_SECONDS):
+        return cached_response(entry)
+    if mode == "replay":
+        return httpx.Response(504, json={"error": {"code": "NOT_CACHED", "message": "Not in the openFDA cache"}})
+
+    try:
+        resp = await request_with_retry(client, params, revalidation_headers(entry), limiter)
+    except httpx.TransportError:
+        if entry:
+            return cached_response(entry)
+        raise
+    if resp.status_code == 304 and entry:
+        write_cache(params, {**entry, "fetched_at": time.time()})
+        return cached_response(entry)
+    if resp.status_code in CACHEABLE_STATUS:
+        if mode != "off":
+            write_cache(params, cache_entry(params, resp))
+    elif entry:
+        return cached_response(entry)
+    return resp
+
+async def fetch_label(drug_name, client=None, limiter=None):
+    # generic name first, then brand name; returns (result, error)
+    if client is None:
+        async with httpx.AsyncClient(timeout=30) as client:
+            return await fetch_label(drug_name, client, limiter)
+    resp = await openfda_get(client, {"search": f"openfda.generic_name:{drug_name}", "limit": 1}, limiter)
+    if resp.status_code != 200 or not resp.json().get("results"):
+        resp = await openfda_get(client, {"search": f"openfda.brand_name:{drug_name}", "limit": 1}, limiter)
+    if resp.status_code != 200:
+        return None, "Could not fetch label"
+    results = resp.json().get("results", [])
+    if not results:
+        return None, "No label found for this drug"
+    return results[0], None
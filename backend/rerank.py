@@ -0,0 +1,65 @@
+import os
+import time
+import asyncio
+import threading
+from cache import LRUCache
+from embed import normalize_query
+
+# cross-encoder rerank: score RERANK_CANDIDATES retrieved chunks against the query, keep the best k
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+# past this, the request keeps the retrieval order; scores computed so far are still cached
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "200"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+# (normalized query, chunk id) -> score; ms-marco MiniLM cross-encoders are uncased as well
+score_cache = LRUCache(RERANK_CACHE_SIZE)
+_model = None
+_model_lock = threading.Lock()
+
+def load_reranker():
+    global _model
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import CrossEncoder
+            _model = CrossEncoder(RERANK_MODEL, device="cpu")
+    return _model
+
+def score_matches(q, matches, budget_ms=RERANK_BUDGET_MS, batch_size=RERANK_BATCH_SIZE):
+    # returns ({chunk id: score}, report); scores is None when the budget ran out first
+    start = time.perf_counter()
+    key = normalize_query(q)
+    scores, todo = {}, []
+    for m in matches:
+        score = score_cache.get((key, m["id"]))
+        if score is None:
+            todo.append(m)
+        else:
+            scores[m["id"]] = score
+    report = {"candidates": len(matches), "cached": len(scores), "scored": 0, "timed_out": False}
+
+    model = load_reranker() if todo else None
+    for i in range(0, len(todo), batch_size):
+        if (time.perf_counter() - start) * 1000 > budget_ms:
+            report["timed_out"] = True
+            break
+        batch = todo[i:i + batch_size]
+        for m, score in zip(batch, model.predict([(q, m["content"]) for m in batch], batch_size=batch_size)):
+            scores[m["id"]] = float(score)
+            score_cache.put((key, m["id"]), float(score))
+        report["scored"] += len(batch)
+    report["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return (None if report["timed_out"] else scores), report
+
+async def rerank_matches(q, matches, k, budget_ms=RERANK_BUDGET_MS):
+    # best k by cross-encoder score, or the first k in retrieval order if the budget ran out
+    scores, report = await asyncio.to_thread(score_matches, q, matches, budget_ms)
+    if scores is None:
+        return matches[:k], report
+    ranked = sorted(matches, key=lambda m: scores[m["id"]], reverse=True)[:k]
+    return [{**m, "rerank_score": round(scores[m["id"]], 4)} for m in ranked], report
+
+def rerank_stats():
+    return score_cache.stats()
@@ -0,0 +1,54 @@
+import os
+import time
+from collections import Counter
+from langchain_core.prompts import ChatPromptTemplate
+from cache import LRUCache
+from db import get_rewrite, save_rewrite
+
+# rewrites are reused for this long, then asked for again
+REWRITE_TTL_SECONDS = int(os.getenv("REWRITE_TTL_SECONDS", str(30 * 24 * 3600)))
+# in-process LRU in front of the query_rewrites table, and the table's row cap
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "4096"))
+REWRITE_MAX_ROWS = int(os.getenv("REWRITE_MAX_ROWS", "100000"))
+
+REWRITE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an FDA medical terminology expert. Rewrite the user's question using clinical FDA label language for better document retrieval. Return only the rewritten query, nothing else."),
+    ("human", "{question}")
+])
+
+rewrite_cache = LRUCache(REWRITE_CACHE_SIZE)
+rewrite_sources = Counter()
+
+def normalize_question(q):
+    # case, spacing and trailing punctuation don't change what the rewrite should be
+    return " ".join(q.lower().split()).rstrip("?!. ")
+
+def cached_rewrite(model_name, q):
+    # in-process hit only, without touching the table or the LLM; None on a miss
+    hit = rewrite_cache.get((normalize_question(q), model_name))
+    if hit and hit[1] > time.time():
+        rewrite_sources["memory"] += 1
+        return hit[0]
+    return None
+
+async def rewrite_query(llm, model_name, q):
+    hit = cached_rewrite(model_name, q)
+    if hit is not None:
+        return hit
+
+    question = normalize_question(q)
+    key = (question, model_name)
+    stored = await get_rewrite(question, model_name, REWRITE_TTL_SECONDS)
+    if stored:
+        rewritten, age = stored
+        rewrite_sources["db"] += 1
+    else:
+        rewritten = (await (REWRITE_PROMPT | llm).ainvoke({"question": q})).content.strip()
+        age = 0
+        await save_rewrite(question, model_name, rewritten, REWRITE_TTL_SECONDS, REWRITE_MAX_ROWS)
+        rewrite_sources["llm"] += 1
+    rewrite_cache.put(key, (rewritten, time.time() + REWRITE_TTL_SECONDS - age))
+    return rewritten
+
+def rewrite_stats():
+    return {**rewrite_cache.stats(), "served_from": dict(rewrite_sources)}
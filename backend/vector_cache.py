@@ -0,0 +1,76 @@
+import os
+import asyncio
+import numpy as np
+from cache import ByteLRUCache
+from db import get_label_chunks
+
+# hot labels' embeddings in process memory; 0 turns the cache off
+VECTOR_CACHE_MB = int(os.getenv("VECTOR_CACHE_MB", "256"))
+# float16 halves the memory per label at a small cost in precision and matmul speed
+VECTOR_CACHE_DTYPE = np.dtype(os.getenv("VECTOR_CACHE_DTYPE", "float32"))
+
+def as_array(embedding):
+    # pgvector returns a Vector (0.3+) or a numpy array (older releases)
+    return embedding.to_numpy() if hasattr(embedding, "to_numpy") else np.asarray(embedding)
+
+class LabelVectors:
+    # one label's chunks and their normalized embeddings as a single contiguous matrix
+    def __init__(self, chunks, dtype=VECTOR_CACHE_DTYPE):
+        self.chunks = [{k: v for k, v in c.items() if k != "embedding"} for c in chunks]
+        matrix = np.stack([as_array(c["embedding"]).astype(np.float32) for c in chunks]) if chunks \
+            else np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = np.ascontiguousarray(matrix / np.where(norms > 0, norms, 1), dtype=dtype)
+        self.nbytes = self.matrix.nbytes + sum(len(c["content"]) + 200 for c in self.chunks)
+
+    def search(self, query_embedding, k):
+        # [(chunk position, cosine distance)] best first: one matrix-vector product + argpartition
+        if not self.chunks:
+            return []
+        q = np.asarray(query_embedding, dtype=np.float32)
+        scores = self.matrix @ (q / (np.linalg.norm(q) or 1)).astype(self.matrix.dtype)
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), 1 - float(scores[i])) for i in top]
+
+label_vectors = ByteLRUCache(VECTOR_CACHE_MB << 20)
+_loading = {}
+
+def invalidate_label(label_id):
+    # embeddings of this label changed (re-ingest filled in missing ones); reload on next use
+    label_vectors.pop(label_id)
+
+async def load_label_vectors(label_id):
+    # Postgres stays the source of truth: a label with chunks still waiting for embeddings is
+    # not cached, so every cached matrix is complete and never goes stale
+    chunks = await get_label_chunks(label_id, with_embeddings=True)
+    if not chunks or any(c["embedding"] is None for c in chunks):
+        return None
+    vectors = await asyncio.to_thread(LabelVectors, chunks)
+    label_vectors.put(label_id, vectors)
+    return vectors
+
+def _loaded(label_id, task):
+    _loading.pop(label_id, None)
+    if not task.cancelled():
+        # a failed load is retried by the next request for the label
+        task.exception()
+
+def warm_label(label_id):
+    # loads in the background, at most one load per label at a time
+    if VECTOR_CACHE_MB <= 0 or label_id in _loading:
+        return
+    task = asyncio.create_task(load_label_vectors(label_id))
+    _loading[label_id] = task
+    task.add_done_callback(lambda t: _loaded(label_id, t))
+
+def label_vector_search(label_id, query_embedding, k):
+    # matches shaped like the label-scoped SQL rows, or None when the label isn't cached yet
+    # (its load is started, and this request goes to Postgres)
+    if VECTOR_CACHE_MB <= 0:
+        return None
+    vectors = label_vectors.get(label_id)
+    if vectors is None:
+        warm_label(label_id)
+        return None
+    return [{**vectors.chunks[i], "distance": distance} for i, distance in vectors.search(query_embedding, k)]
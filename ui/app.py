@@ -1,9 +1,16 @@
 import os
 import json
+import time
+import atexit
+import threading
 import hashlib
 import httpx
+import numpy as np
+import psycopg
 import streamlit as st
-from sqlalchemy import create_engine, text
+from collections import OrderedDict
+from pgvector.psycopg import register_vector
+from sqlalchemy import create_engine, event, text
 from sentence_transformers import SentenceTransformer
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
@@ -18,11 +25,40 @@ st.set_page_config(
 
 # ── Database ─────────────────────────────────────────────────────────────────
 DB_URL = os.environ.get("DB_URL", "")
-engine = create_engine(DB_URL.replace("postgresql://", "postgresql+psycopg2://"), future=True)
+engine = create_engine(DB_URL.replace("postgresql://", "postgresql+psycopg://"), future=True)
+
+EMBED_MODEL = os.environ.get("EMBED_MODEL", "all-MiniLM-L6-v2")
+# torch | onnx | onnx-int8, as in backend/embed.py; int8 vectors are stored under their own key
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch")
+EMBED_ONNX_INT8_FILE = os.environ.get("EMBED_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+EMBED_KEY = f"{EMBED_MODEL}@int8" if EMBED_BACKEND == "onnx-int8" else EMBED_MODEL
+
+@event.listens_for(engine, "connect")
+def register_vector_types(dbapi_conn, _):
+    try:
+        register_vector(dbapi_conn)
+    except psycopg.ProgrammingError:
+        pass
+
+def to_vector(embedding):
+    return np.asarray(embedding, dtype=np.float32)
+
+def has_column(conn, table, column):
+    # ALTER TABLE ... ADD COLUMN IF NOT EXISTS still takes an ACCESS EXCLUSIVE lock, so the
+    # migrations below only run when the column is really missing
+    return conn.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column;
+    """), {"table": table, "column": column}).first() is not None
 
+@st.cache_resource
 def init_db():
+    # once per process: Streamlit reruns the script on every interaction
     with engine.connect() as conn:
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
+        conn.commit()
+    engine.dispose()
+    with engine.connect() as conn:
         conn.execute(text("""
             CREATE TABLE IF NOT EXISTS drug_labels (
                 id SERIAL PRIMARY KEY,
@@ -49,15 +85,103 @@ def init_db():
                 UNIQUE(label_id, section, chunk_index)
             );
         """))
+        if not has_column(conn, "drug_labels", "set_id"):
+            conn.execute(text("ALTER TABLE drug_labels ADD COLUMN IF NOT EXISTS set_id TEXT;"))
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS drug_labels_identity
+            ON drug_labels (set_id, effective_time);
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS label_queries (
+                drug_query TEXT PRIMARY KEY,
+                label_id INT NOT NULL REFERENCES drug_labels(id) ON DELETE CASCADE,
+                checked_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS chunk_embeddings (
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                embedding vector(384) NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (content_hash, model)
+            );
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS query_rewrites (
+                question TEXT NOT NULL,
+                model TEXT NOT NULL,
+                rewritten TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                last_used_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (question, model)
+            );
+        """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS query_rewrites_last_used ON query_rewrites (last_used_at);
+        """))
+        if not has_column(conn, "label_chunks", "content_tsv"):
+            conn.execute(text("""
+                ALTER TABLE label_chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector
+                GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+            """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS label_chunks_content_tsv_gin
+            ON label_chunks USING gin (content_tsv);
+        """))
         conn.commit()
 
-def save_label(drug_query, brand_name, generic_name, manufacturer, effective_time, sections, raw_result):
+def content_hash(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def get_known_hashes(hashes):
+    if not hashes:
+        return set()
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT content_hash FROM chunk_embeddings
+            WHERE model = :model AND content_hash = ANY(CAST(:hashes AS text[]));
+        """), {"model": EMBED_KEY, "hashes": list(set(hashes))}).scalars().all()
+    return set(rows)
+
+def normalize_drug_query(drug_query):
+    return " ".join(drug_query.lower().split())
+
+def touch_label_query(conn, drug_query, label_id):
+    conn.execute(text("""
+        INSERT INTO label_queries (drug_query, label_id, checked_at)
+        VALUES (:drug_query, :label_id, NOW())
+        ON CONFLICT (drug_query) DO UPDATE SET label_id = EXCLUDED.label_id, checked_at = NOW();
+    """), {"drug_query": normalize_drug_query(drug_query), "label_id": label_id})
+
+def get_fresh_label(drug_query, ttl_seconds):
     with engine.connect() as conn:
-        result = conn.execute(text("""
+        row = conn.execute(text("""
+            SELECT l.id AS label_id, l.brand_name, l.generic_name,
+                   ARRAY(SELECT jsonb_object_keys(l.sections)) AS sections_found
+            FROM label_queries q JOIN drug_labels l ON l.id = q.label_id
+            WHERE q.drug_query = :drug_query
+              AND q.checked_at > NOW() - make_interval(secs => CAST(:ttl AS double precision));
+        """), {"drug_query": normalize_drug_query(drug_query), "ttl": ttl_seconds}).mappings().fetchone()
+    return dict(row) if row else None
+
+def find_label(set_id, effective_time):
+    if not set_id:
+        return None
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT id FROM drug_labels WHERE set_id = :set_id AND effective_time = :effective_time;"
+        ), {"set_id": set_id, "effective_time": effective_time}).scalar()
+
+def save_label_with_chunks(drug_query, brand_name, generic_name, manufacturer, effective_time,
+                           sections, raw_result, chunks, embeddings):
+    with engine.begin() as conn:
+        label_id = conn.execute(text("""
             INSERT INTO drug_labels
-            (drug_query, brand_name, generic_name, manufacturer, effective_time, sections, raw_result)
+            (drug_query, brand_name, generic_name, manufacturer, effective_time, sections, raw_result, set_id)
             VALUES (:drug_query, :brand_name, :generic_name, :manufacturer, :effective_time,
-                    CAST(:sections AS jsonb), CAST(:raw_result AS jsonb))
+                    CAST(:sections AS jsonb), CAST(:raw_result AS jsonb), :set_id)
+            ON CONFLICT (set_id, effective_time) DO NOTHING
             RETURNING id;
         """), {
             "drug_query": drug_query,
@@ -67,36 +191,47 @@ def save_label(drug_query, brand_name, generic_name, manufacturer, effective_tim
             "effective_time": effective_time,
             "sections": json.dumps(sections),
             "raw_result": json.dumps(raw_result),
-        })
-        label_id = result.fetchone()[0]
-        conn.commit()
-    return label_id
-
-def save_chunks(label_id, chunks):
-    with engine.connect() as conn:
-        for section, chunk_index, content in chunks:
-            content_hash = hashlib.sha256(content.encode()).hexdigest()
+            "set_id": raw_result.get("set_id") or raw_result.get("id"),
+        }).scalar()
+        if label_id is None:
+            # stored concurrently by another session
+            label_id = conn.execute(text(
+                "SELECT id FROM drug_labels WHERE set_id = :set_id AND effective_time = :effective_time;"
+            ), {"set_id": raw_result.get("set_id") or raw_result.get("id"),
+                "effective_time": effective_time}).scalar_one()
+        elif chunks:
+            hashes = [content_hash(content) for _, _, content in chunks]
+            embs = [None if emb is None else to_vector(emb) for emb in embeddings]
+            if all(emb is None for emb in embs):
+                embs = None
             conn.execute(text("""
-                INSERT INTO label_chunks (label_id, section, chunk_index, content, content_hash)
-                VALUES (:label_id, :section, :chunk_index, :content, :content_hash)
+                INSERT INTO label_chunks (label_id, section, chunk_index, content, content_hash, embedding)
+                SELECT :label_id, t.section, t.chunk_index, t.content, t.content_hash,
+                       COALESCE(t.emb, e.embedding)
+                FROM unnest(CAST(:sections AS text[]), CAST(:chunk_indexes AS int[]),
+                            CAST(:contents AS text[]), CAST(:hashes AS text[]), CAST(:embs AS vector[]))
+                     AS t(section, chunk_index, content, content_hash, emb)
+                LEFT JOIN chunk_embeddings e ON e.content_hash = t.content_hash AND e.model = :model
                 ON CONFLICT (label_id, section, chunk_index) DO NOTHING;
-            """), {"label_id": label_id, "section": section, "chunk_index": chunk_index,
-                   "content": content, "content_hash": content_hash})
-        conn.commit()
-
-def save_embedding(chunk_id, embedding):
-    emb_str = "[" + ",".join([str(float(x)) for x in embedding]) + "]"
-    with engine.connect() as conn:
-        conn.execute(text("UPDATE label_chunks SET embedding = :emb WHERE id = :id;"),
-                     {"emb": emb_str, "id": chunk_id})
-        conn.commit()
-
-def get_chunks_without_embeddings():
-    with engine.connect() as conn:
-        rows = conn.execute(text(
-            "SELECT id, content FROM label_chunks WHERE embedding IS NULL ORDER BY id;"
-        )).mappings().all()
-    return [dict(r) for r in rows]
+            """), {
+                "label_id": label_id,
+                "sections": [section for section, _, _ in chunks],
+                "chunk_indexes": [chunk_index for _, chunk_index, _ in chunks],
+                "contents": [content for _, _, content in chunks],
+                "hashes": hashes,
+                "embs": embs,
+                "model": EMBED_KEY,
+            })
+            if embs:
+                conn.execute(text("""
+                    INSERT INTO chunk_embeddings (content_hash, model, embedding)
+                    SELECT t.content_hash, :model, t.emb
+                    FROM unnest(CAST(:hashes AS text[]), CAST(:embs AS vector[])) AS t(content_hash, emb)
+                    WHERE t.emb IS NOT NULL
+                    ON CONFLICT (content_hash, model) DO NOTHING;
+                """), {"hashes": hashes, "embs": embs, "model": EMBED_KEY})
+        touch_label_query(conn, drug_query, label_id)
+    return label_id
 
 def get_recent_labels(limit=10):
     with engine.connect() as conn:
@@ -125,12 +260,90 @@ def get_label_detail(label_id):
 # ── ML Models (cached) ────────────────────────────────────────────────────────
 @st.cache_resource
 def load_embedding_model():
-    return SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+    if EMBED_BACKEND == "torch":
+        return SentenceTransformer(EMBED_MODEL, device="cpu")
+    model_kwargs = {"provider": "CPUExecutionProvider"}
+    if EMBED_BACKEND == "onnx-int8":
+        model_kwargs["file_name"] = EMBED_ONNX_INT8_FILE
+    return SentenceTransformer(EMBED_MODEL, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+# normalized query text -> embedding; QUERY_CACHE_PATH keeps it across restarts
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "4096"))
+QUERY_CACHE_PATH = os.environ.get("QUERY_CACHE_PATH", "")
+
+class LRUCache:
+    # thread-safe, size-bounded LRU; Streamlit reruns share it through st.cache_resource
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self.data), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
+
+def save_query_cache(cache, path):
+    # same file format as backend/cache.py
+    with cache.lock:
+        items = list(cache.data.items())
+    if not items:
+        return
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp, model=np.array(EMBED_KEY), keys=np.array([k for k, _ in items]),
+             embeddings=np.stack([v for _, v in items]))
+    os.replace(tmp, path)
+
+@st.cache_resource
+def load_query_cache():
+    cache = LRUCache(QUERY_CACHE_SIZE)
+    if QUERY_CACHE_PATH:
+        if os.path.exists(QUERY_CACHE_PATH):
+            with np.load(QUERY_CACHE_PATH, allow_pickle=False) as f:
+                if str(f["model"]) == EMBED_KEY:
+                    for key, emb in zip(f["keys"], f["embeddings"]):
+                        cache.put(str(key), emb)
+        atexit.register(save_query_cache, cache, QUERY_CACHE_PATH)
+    return cache
+
+def encode_query(q, embed_model):
+    # all-MiniLM-L6-v2 lowercases and splits on whitespace anyway, so this never changes its embedding
+    key = " ".join(q.lower().split())
+    cache = load_query_cache()
+    emb = cache.get(key)
+    if emb is None:
+        emb = embed_model.encode(key, normalize_embeddings=True)
+        cache.put(key, emb)
+    return emb
+
+LLM_MODEL = os.environ.get("LLM_MODEL", "gemini-2.0-flash")
 
 @st.cache_resource
 def load_llm():
     return ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
+        model=LLM_MODEL,
         google_api_key=os.environ.get("GOOGLE_API_KEY")
     )
 
@@ -142,6 +355,8 @@ SECTIONS = [
 ]
 CHUNK_SIZE = 900
 CHUNK_OVERLAP = 120
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "64"))
+LABEL_TTL_SECONDS = int(os.environ.get("LABEL_TTL_SECONDS", str(24 * 3600)))
 
 def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     chunks = []
@@ -153,16 +368,93 @@ def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     return chunks
 
 # ── Core Logic ────────────────────────────────────────────────────────────────
+def encode_chunks(chunks, embed_model, batch_size=EMBED_BATCH_SIZE):
+    # only text without a stored embedding is encoded; None entries reuse the stored one
+    start = time.perf_counter()
+    hashes = [content_hash(content) for _, _, content in chunks]
+    known = get_known_hashes(hashes)
+    unseen = {}
+    for h, (_, _, content) in zip(hashes, chunks):
+        if h not in known and h not in unseen:
+            unseen[h] = content
+    texts = list(unseen.values())
+    encoded = []
+    for i in range(0, len(texts), batch_size):
+        encoded.extend(embed_model.encode(texts[i:i + batch_size], batch_size=batch_size,
+                                          normalize_embeddings=True))
+    by_hash = dict(zip(unseen, encoded))
+    seconds = time.perf_counter() - start
+    return [by_hash.get(h) for h in hashes], {
+        "chunks": len(chunks),
+        "encoded": len(unseen),
+        "reused": len(chunks) - len(unseen),
+        "hit_rate": round((len(chunks) - len(unseen)) / len(chunks), 3) if chunks else 0.0,
+        "seconds": round(seconds, 3),
+        "chunks_per_sec": round(len(chunks) / seconds, 1) if seconds > 0 else 0.0,
+    }
+
+OPENFDA_LABEL_URL = "https://api.fda.gov/drug/label.json"
+# on-disk response cache: readwrite | replay (cache only, no network) | off
+OPENFDA_CACHE_MODE = os.environ.get("OPENFDA_CACHE_MODE", "readwrite")
+OPENFDA_CACHE_DIR = os.environ.get("OPENFDA_CACHE_DIR", ".openfda_cache")
+OPENFDA_CACHE_TTL_SECONDS = int(os.environ.get("OPENFDA_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+def write_openfda_cache(path, entry):
+    os.makedirs(OPENFDA_CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+def openfda_get(client, params):
+    # same cache files as backend/openfda.py, so either side can replay what the other fetched;
+    # returns (status, json body)
+    key = json.dumps(params, sort_keys=True)
+    path = os.path.join(OPENFDA_CACHE_DIR, hashlib.sha256(key.encode()).hexdigest() + ".json")
+    entry = None
+    if OPENFDA_CACHE_MODE != "off" and os.path.exists(path):
+        with open(path) as f:
+            entry = json.load(f)
+    if entry and (OPENFDA_CACHE_MODE == "replay" or time.time() - entry["fetched_at"] < OPENFDA_CACHE_TTL_SECONDS):
+        return entry["status"], json.loads(entry["body"])
+    if OPENFDA_CACHE_MODE == "replay":
+        return 504, {}
+
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        resp = client.get(OPENFDA_LABEL_URL, params=params, headers=headers)
+    except httpx.TransportError:
+        if entry:
+            return entry["status"], json.loads(entry["body"])
+        raise
+    if resp.status_code == 304 and entry:
+        entry["fetched_at"] = time.time()
+    elif resp.status_code in (200, 404):  # 404 is openFDA's "no matches"
+        entry = {"params": params, "status": resp.status_code, "body": resp.text,
+                 "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified"),
+                 "fetched_at": time.time()}
+    elif not entry:
+        return resp.status_code, {}
+    if OPENFDA_CACHE_MODE != "off":
+        write_openfda_cache(path, entry)
+    return entry["status"], json.loads(entry["body"])
+
 def fetch_and_store_label(drug_name, embed_model):
-    url = "https://api.fda.gov/drug/label.json"
-    with httpx.Client() as client:
-        resp = client.get(url, params={"search": f"openfda.generic_name:{drug_name}", "limit": 1})
-        if resp.status_code != 200 or not resp.json().get("results"):
-            resp = client.get(url, params={"search": f"openfda.brand_name:{drug_name}", "limit": 1})
-        if resp.status_code != 200:
+    fresh = get_fresh_label(drug_name, LABEL_TTL_SECONDS)
+    if fresh:
+        return {**fresh, "drug": drug_name, "cached": True}, None
+
+    with httpx.Client(timeout=30) as client:
+        status, data = openfda_get(client, {"search": f"openfda.generic_name:{drug_name}", "limit": 1})
+        if status != 200 or not data.get("results"):
+            status, data = openfda_get(client, {"search": f"openfda.brand_name:{drug_name}", "limit": 1})
+        if status != 200:
             return None, "Could not fetch label from FDA API."
 
-    data = resp.json()
     results = data.get("results", [])
     if not results:
         return None, "No label found for this drug."
@@ -180,18 +472,21 @@ def fetch_and_store_label(drug_name, embed_model):
         if val:
             sections[s] = val[0] if isinstance(val, list) else val
 
-    label_id = save_label(drug_name, brand_name, generic_name, manufacturer, effective_time, sections, r)
+    existing = find_label(r.get("set_id") or r.get("id"), effective_time)
+    if existing:
+        with engine.begin() as conn:
+            touch_label_query(conn, drug_name, existing)
+        return {"label_id": existing, "drug": drug_name, "brand_name": brand_name,
+                "generic_name": generic_name, "sections_found": list(sections.keys()), "cached": True}, None
 
     all_chunks = []
     for section, content in sections.items():
         for i, chunk in enumerate(chunk_text(content)):
             all_chunks.append((section, i, chunk))
-    save_chunks(label_id, all_chunks)
 
-    chunks_to_embed = get_chunks_without_embeddings()
-    for chunk in chunks_to_embed:
-        embedding = embed_model.encode(chunk["content"], normalize_embeddings=True)
-        save_embedding(chunk["id"], embedding)
+    embeddings, embed_report = encode_chunks(all_chunks, embed_model)
+    label_id = save_label_with_chunks(drug_name, brand_name, generic_name, manufacturer,
+                                      effective_time, sections, r, all_chunks, embeddings)
 
     return {
         "label_id": label_id,
@@ -199,24 +494,40 @@ def fetch_and_store_label(drug_name, embed_model):
         "brand_name": brand_name,
         "generic_name": generic_name,
         "sections_found": list(sections.keys()),
+        "cached": False,
+        "embedding": embed_report,
     }, None
 
 def rag_search(q, embed_model, k=5, label_id=None):
-    query_embedding = embed_model.encode(q, normalize_embeddings=True)
-    emb_str = "[" + ",".join([str(float(x)) for x in query_embedding]) + "]"
+    query_embedding = encode_query(q, embed_model)
     label_filter = "AND label_id = :label_id" if label_id else ""
-    params = {"emb": emb_str, "k": k}
+    params = {"emb": to_vector(query_embedding), "k": k}
     if label_id:
         params["label_id"] = label_id
 
     with engine.connect() as conn:
-        rows = conn.execute(text(f"""
-            SELECT id, label_id, section, chunk_index, content,
-                   embedding <=> CAST(:emb AS vector) AS distance
-            FROM label_chunks
-            WHERE embedding IS NOT NULL {label_filter}
-            ORDER BY distance ASC LIMIT :k;
-        """), params).mappings().all()
+        if label_id:
+            # scope first so a label-scoped search stays exact even when an ANN index exists
+            rows = conn.execute(text("""
+                WITH scoped AS MATERIALIZED (
+                    SELECT id, label_id, section, chunk_index, content, embedding
+                    FROM label_chunks
+                    WHERE label_id = :label_id AND embedding IS NOT NULL
+                )
+                SELECT id, label_id, section, chunk_index, content,
+                       embedding <=> :emb AS distance
+                FROM scoped
+                ORDER BY distance ASC LIMIT :k;
+            """), params).mappings().all()
+        else:
+            # unscoped: plain nearest-neighbour order so the ANN index can serve it
+            rows = conn.execute(text("""
+                SELECT id, label_id, section, chunk_index, content,
+                       embedding <=> :emb AS distance
+                FROM label_chunks
+                WHERE embedding IS NOT NULL
+                ORDER BY embedding <=> :emb LIMIT :k;
+            """), params).mappings().all()
 
     matches = [dict(r) for r in rows]
     used_fallback = False
@@ -225,23 +536,76 @@ def rag_search(q, embed_model, k=5, label_id=None):
         used_fallback = True
         with engine.connect() as conn:
             fb_rows = conn.execute(text(f"""
-                SELECT id, label_id, section, chunk_index, content, 0.60 AS distance
-                FROM label_chunks
-                WHERE to_tsvector('english', content) @@ plainto_tsquery('english', :q)
-                {label_filter} LIMIT :k;
+                SELECT id, label_id, section, chunk_index, content,
+                       ts_rank_cd(content_tsv, query, 32) AS rank
+                FROM label_chunks, plainto_tsquery('english', :q) AS query
+                WHERE content_tsv @@ query {label_filter}
+                ORDER BY rank DESC LIMIT :k;
             """), {**params, "q": q}).mappings().all()
         if fb_rows:
             matches = [dict(r) for r in fb_rows]
 
     return matches, used_fallback
 
-def generate_answer(q, matches, used_fallback, llm):
-    rewrite_prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an FDA medical terminology expert. Rewrite the user question using clinical FDA label language for better document retrieval. Return only the rewritten query, nothing else."),
-        ("human", "{question}")
-    ])
-    rewritten_q = (rewrite_prompt | llm).invoke({"question": q}).content.strip()
+REWRITE_TTL_SECONDS = int(os.environ.get("REWRITE_TTL_SECONDS", str(30 * 24 * 3600)))
+REWRITE_CACHE_SIZE = int(os.environ.get("REWRITE_CACHE_SIZE", "4096"))
+REWRITE_MAX_ROWS = int(os.environ.get("REWRITE_MAX_ROWS", "100000"))
+
+REWRITE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an FDA medical terminology expert. Rewrite the user question using clinical FDA label language for better document retrieval. Return only the rewritten query, nothing else."),
+    ("human", "{question}")
+])
+
+def normalize_question(q):
+    # case, spacing and trailing punctuation don't change what the rewrite should be
+    return " ".join(q.lower().split()).rstrip("?!. ")
+
+def stored_rewrite(question, q, llm):
+    # same query_rewrites table as the backend; returns (rewritten, age in seconds)
+    params = {"question": question, "model": LLM_MODEL, "ttl": REWRITE_TTL_SECONDS}
+    with engine.begin() as conn:
+        row = conn.execute(text("""
+            UPDATE query_rewrites SET last_used_at = NOW()
+            WHERE question = :question AND model = :model
+              AND created_at > NOW() - make_interval(secs => :ttl)
+            RETURNING rewritten, EXTRACT(EPOCH FROM NOW() - created_at) AS age;
+        """), params).fetchone()
+    if row:
+        return row.rewritten, float(row.age)
+
+    rewritten = (REWRITE_PROMPT | llm).invoke({"question": q}).content.strip()
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO query_rewrites (question, model, rewritten)
+            VALUES (:question, :model, :rewritten)
+            ON CONFLICT (question, model) DO UPDATE
+            SET rewritten = EXCLUDED.rewritten, created_at = NOW(), last_used_at = NOW();
+        """), {**params, "rewritten": rewritten})
+        conn.execute(text("""
+            DELETE FROM query_rewrites
+            WHERE created_at < NOW() - make_interval(secs => :ttl)
+               OR last_used_at <= (SELECT last_used_at FROM query_rewrites
+                                  ORDER BY last_used_at DESC OFFSET :max_rows LIMIT 1);
+        """), {"ttl": REWRITE_TTL_SECONDS, "max_rows": REWRITE_MAX_ROWS})
+    return rewritten, 0.0
+
+@st.cache_resource
+def load_rewrite_cache():
+    return LRUCache(REWRITE_CACHE_SIZE)
+
+def rewrite_question(q, llm):
+    # keyed by model too, like query_rewrites, so switching LLM_MODEL never serves stale rewrites
+    question = normalize_question(q)
+    key = (LLM_MODEL, question)
+    cache = load_rewrite_cache()
+    hit = cache.get(key)
+    if hit and hit[1] > time.time():
+        return hit[0]
+    rewritten, age = stored_rewrite(question, q, llm)
+    cache.put(key, (rewritten, time.time() + REWRITE_TTL_SECONDS - age))
+    return rewritten
 
+def generate_answer(q, matches, used_fallback, llm):
     evidence_block = ""
     for i, m in enumerate(matches):
         evidence_block += f"[{i+1}] Section: {m['section']}\n{m['content']}\n\n"
@@ -255,8 +619,10 @@ Use ONLY the evidence provided. If the evidence does not contain the answer, say
         ("human", "Question: {question}\n\nEvidence:\n{evidence}")
     ])
 
-    response = (prompt | llm).invoke({"question": q, "evidence": evidence_block})
-    return response.content, rewritten_q
+    # yields text as Gemini produces it, for st.write_stream
+    for chunk in (prompt | llm).stream({"question": q, "evidence": evidence_block}):
+        if chunk.content:
+            yield chunk.content
 
 # ── UI Styles ─────────────────────────────────────────────────────────────────
 st.markdown("""
@@ -373,13 +739,22 @@ if st.button("Get Answer"):
         st.stop()
 
     label_id = label_data.get("label_id")
-
-    with st.spinner("Searching FDA label and generating answer..."):
-        matches, used_fallback = rag_search(question, embed_model, k=top_k, label_id=label_id)
+    embed_report = label_data.get("embedding", {})
+    if embed_report.get("chunks"):
+        st.caption(f"Embedded {embed_report['chunks']} chunks in {embed_report['seconds']}s "
+                   f"({embed_report['chunks_per_sec']} chunks/sec, {embed_report['hit_rate']:.0%} reused)")
+
+    answer_start = time.perf_counter()
+    with st.spinner("Searching FDA label..."):
+        # retrieve with the clinical rewrite, answer the question as asked
+        rewritten_q = rewrite_question(question, llm)
+        matches, used_fallback = rag_search(rewritten_q, embed_model, k=top_k, label_id=label_id)
         if not matches:
             st.warning("No relevant information found in the saved labels.")
             st.stop()
-        answer, rewritten_q = generate_answer(question, matches, used_fallback, llm)
+    query_stats = load_query_cache().stats()
+    st.caption(f"Query embedding cache: {query_stats['hit_rate']:.0%} hits, "
+               f"{query_stats['size']}/{query_stats['maxsize']} entries")
 
     fb_label = "keyword fallback" if used_fallback else "semantic search"
     fb_color = "#c97c2a" if used_fallback else "#2a9d6e"
@@ -396,18 +771,24 @@ if st.button("Get Answer"):
         </span>
         <span style="font-family:'JetBrains Mono',monospace;font-size:10px;color:{fb_color};">{fb_label}</span>
       </div>
-      <div style="padding:22px;font-size:15px;line-height:1.85;color:#3a3730;font-weight:300;">{answer}</div>
     </div>
     """, unsafe_allow_html=True)
+    # filled in after the evidence below is on screen, token by token
+    answer_slot = st.container()
 
     if matches:
         st.markdown("<div style='font-family:JetBrains Mono,monospace;font-size:10px;color:#b0a99f;letter-spacing:1.5px;text-transform:uppercase;margin:36px 0 14px 0;'>FDA Label Evidence</div>", unsafe_allow_html=True)
         for c in matches:
             section = c.get("section", "unknown")
             dist = c.get("distance")
-            dist_str = f"{float(dist):.4f}" if dist is not None else "—"
             chunk_id = c.get("id", "?")
-            dist_color = "#2a9d6e" if dist and float(dist) < 0.4 else "#c97c2a" if dist and float(dist) < 0.6 else "#c0392b"
+            if dist is None and c.get("rank") is not None:
+                # keyword fallback: a text-search rank, not a distance, so no quality colouring
+                dist_label, dist_str, dist_color = "rank", f"{float(c['rank']):.4f}", "#b0a99f"
+            else:
+                dist_label = "dist"
+                dist_str = f"{float(dist):.4f}" if dist is not None else "—"
+                dist_color = "#2a9d6e" if dist and float(dist) < 0.4 else "#c97c2a" if dist and float(dist) < 0.6 else "#c0392b"
 
             st.markdown(f"""
             <div style="background:#ffffff;border:1.5px solid #e2ddd6;border-radius:12px;overflow:hidden;margin-bottom:10px;">
@@ -419,7 +800,7 @@ if st.button("Get Answer"):
                                border:1px solid #d0d8fc;color:#4a6cf7;padding:2px 8px;border-radius:4px;">{section}</span>
                 </div>
                 <span style="font-family:'JetBrains Mono',monospace;font-size:10px;color:#b0a99f;">
-                  dist <span style="color:{dist_color};">{dist_str}</span>
+                  {dist_label} <span style="color:{dist_color};">{dist_str}</span>
                 </span>
               </div>
             </div>
@@ -429,6 +810,18 @@ if st.button("Get Answer"):
                 chunk_data = get_chunk_content(chunk_id)
                 st.write(chunk_data.get("content", "Could not load chunk."))
 
+    with answer_slot:
+        first_token = []
+        def timed(parts):
+            for part in parts:
+                if not first_token:
+                    first_token.append(time.perf_counter() - answer_start)
+                yield part
+        st.write_stream(timed(generate_answer(question, matches, used_fallback, llm)))
+        if first_token:
+            st.caption(f"First token after {first_token[0]:.2f}s, "
+                       f"full answer after {time.perf_counter() - answer_start:.2f}s")
+
 # ── Saved Labels ──────────────────────────────────────────────────────────────
 st.markdown("<div style='font-family:JetBrains Mono,monospace;font-size:10px;color:#b0a99f;letter-spacing:1.5px;text-transform:uppercase;margin:36px 0 14px 0;'>Saved Labels</div>", unsafe_allow_html=True)
 